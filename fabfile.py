@@ -3,11 +3,11 @@ Install and deploy projects on Opalstack (and others). Uses Fabric 2+.
 See https://github.com/fabric/fabric
 """
 from invoke import Collection
-from fabric import task, Connection
+from fabric import task
 
 from tasks._constants import *
-from tasks import (control, server, user, application, python, supervisor,
-                   virtual_env, project, database, redis, config)
+from tasks import (control, user, application, python, supervisor,
+                   virtual_env, project, database, redis, config, _scheduler, _journal, _connection)
 
 DEFAULT_CONFIG = {
     'inline_ssh_env': True,
@@ -21,27 +21,43 @@ DEFAULT_CONFIG = {
         'local': '.',
     },
     'data': {},
+    'wait': {
+        'timeout': 60,  # overall deadline in seconds when waiting for control panel resources
+        'initial_delay': 0.25,
+        'max_delay': 5,
+    },
     'archive_excludes': ['__pycache__', '.DS_Store'],
+    'compression': {
+        'codec': 'auto',  # zstd, pigz or gzip, auto picks the fastest available
+        'level': None,  # default level of codec
+        'threads': 0,  # 0: all cores
+    },
+    'build': {
+        'jobs': 0,  # parallel make jobs, 0: all cores
+        'optimizations': False,  # python: --enable-optimizations --with-lto
+        'cache': True,  # reuse builds of the same version, os and arch
+        'cache_path': None,  # default: .build-cache next to fabric.yml
+    },
+    'scheduler': {
+        'workers': 1,  # max number of tasks running in parallel, 1: one by one
+    },
 }
 
 
-def execute_tasks(c, tasks):
+def execute_tasks(c, tasks, name=None, resume=False):
     # note: this seems silly, fabric has a tasks executor, but what about 'c'?
     # also: instead of 'return' (exit on error) use 'continue' (on error)? use command-arg?
-    for t in tasks:
-        try:
-            print(f'\n------------------------------------------------------')
-            print(f'{YELLOW}Executing {t.__module__}.{t.__name__}{COL_END}\n')
-            result = t(c)
-        except Exception as e:
-            print(f'{RED}{e}{COL_END}')
-            return
-        else:
-            if not result:
-                return
-            elif isinstance(result, Connection):
-                c = result
-    return c
+    # tasks declaring their needs/provides run in parallel, see tasks/_scheduler.py
+    # named runs keep a journal of completed tasks, to continue with --resume after an error
+    journal = None
+    if name:
+        journal = _journal.Journal(c, name)
+        if not (resume and journal.load()):
+            journal.clear()
+
+    result = _scheduler.execute(c, tasks, workers=c.config.scheduler.workers, journal=journal)
+    _connection.report()
+    return result
 
 
 def pretty_print(c):
@@ -63,100 +79,123 @@ def env(c):
 
 
 @task
-def rollback(c):
+def snapshots(c):
+    # list snapshots of project files on remote (with project.backup: snapshot)
+    c = user.update_ssh(c)
+    application.get_info(c)
+    project.list_snapshots(c)
+
+
+@task
+def rollback(c, resume=False, snapshot=None):
+    # optionally restore project files from a given snapshot, see: fab snapshots
+    if snapshot:
+        c.config.data.restore_snapshot = snapshot
+
     tasks = [
         # get fresh api token
         control.login,
 
+        # gather ids and app info from control panel
+        control.discover,
+
         # plug into ssh config
         user.update_ssh,
 
         # gather redis info
         redis.find_bin,
-        redis.get_id,
         redis.get_info,
 
         # gather main app info
-        application.get_id,
         application.get_info,
 
         # restore project
         project.restore_db,
         project.restore_project,
 
+        # env of the restored requirements, with project.envs
+        project.restore_requirements,
+
         # update app config & restart
         supervisor.update_configs,
         supervisor.restart,
+
+        # api call timings
+        control.report,
     ]
 
-    execute_tasks(c, tasks)
+    execute_tasks(c, tasks, 'rollback', resume)
 
 
 @task
-def deploy(c):
+def deploy(c, resume=False):
     tasks = [
         # get fresh api token
         control.login,
 
+        # gather ids and app info from control panel
+        control.discover,
+
         # plug into ssh config
         user.update_ssh,
 
         # gather redis info
         redis.find_bin,
-        redis.get_id,
         redis.get_info,
 
         # gather main app info
-        application.get_id,
         application.get_info,
 
         # backup
         project.backup_db,
         project.backup_project,
 
-        # update code / requirements / statics / db
+        # update code / requirements
         project.upload,
         project.install_requirements,
+
+        # update statics / db
         project.update_static_files,
         project.migrate_db,
 
         # update app config & restart
         supervisor.update_configs,
         supervisor.restart,
+
+        # api call timings
+        control.report,
     ]
 
-    execute_tasks(c, tasks)
+    execute_tasks(c, tasks, 'deploy', resume)
 
 
 @task
-def install(c):
+def install(c, resume=False):
     tasks = [
         # get fresh api token
         control.login,
 
-        # info needed for creates
-        server.get_id,
+        # info needed for creates: ids of server, user, apps and database
+        control.discover,
 
         # create user in control panel and new ssh config
-        user.get_id,
         user.create,
         user.get_info,
         user.update_ssh,
 
+        # create main, redis and supervisor apps in control panel
+        application.create_all,
+
         # install python
         python.install_bin,
         python.find_bin,
 
-        # install redis and create redis app in control panel
+        # install redis and gather redis app info
         redis.install_bin,
         redis.find_bin,
-        redis.get_id,
-        redis.create,
         redis.get_info,
 
-        # create main app in control panel
-        application.get_id,
-        application.create,
+        # gather main app info
         application.get_info,
 
         # install env, project, requirements, files and db
@@ -166,15 +205,12 @@ def install(c):
         project.update_static_files,
 
         # create database
-        database.get_id,
         database.create,
 
         # skipping upload/restore of db - do this manually
 
         # install & start superuser
         supervisor.install_bin,
-        supervisor.get_id,
-        supervisor.create,
         supervisor.create_configs,
         supervisor.start,
 
@@ -183,17 +219,20 @@ def install(c):
 
         # print all retrieved info (db pass, etc)
         pretty_print,
+
+        # api call timings
+        control.report,
     ]
 
-    execute_tasks(c, tasks)
+    execute_tasks(c, tasks, 'install', resume)
 
 
 @task
 def test(c):
     tasks = [
         control.login,
+        control.discover,
         user.update_ssh,
-        application.get_id,
         application.get_info,
         virtual_env.create,
     ]
@@ -202,5 +241,5 @@ def test(c):
 
 
 # set default config (will be picked up by fabric/invoke)
-ns = Collection(install, deploy, rollback, env, test)
+ns = Collection(install, deploy, rollback, env, snapshots, test)
 ns.configure(DEFAULT_CONFIG)
@@ -1,17 +1,62 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_HOST = 'my.opalstack.com'
 API_BASE_URI = '/api/v1'
 
-__all__ = ['API', 'ApiException']
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) in seconds
+DEFAULT_CONCURRENCY = 6
+
+# time to live, in seconds, of cached list responses
+DEFAULT_CACHE_TTLS = {
+    '/app/list/': 60,
+    '/osuser/list/': 60,
+    '/server/list/': 3600,
+    '/psqldb/list/': 60,
+    '/mariadb/list/': 60,
+}
+
+# record key of list responses that are wrapped in a dictionary
+LIST_KEYS = {
+    '/app/list/': 'apps',
+    '/osuser/list/': 'users',
+    '/server/list/': 'web_servers',
+    '/psqldb/list/': 'psqldbs',
+    '/mariadb/list/': 'mariadbs',
+}
+
+# record fields to index list responses by
+INDEX_FIELDS = ('id', 'name', 'hostname', 'osuser', 'server')
+
+__all__ = ['API', 'AsyncAPI', 'ApiException', 'Index']
 
 
 class API:
 
-    def __init__(self, token=None, username=None, password=None):
+    def __init__(self, token=None, username=None, password=None, pool_size=DEFAULT_POOL_SIZE,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT,
+                 cache_ttls=None):
         if token is None and username is None:
             raise ApiException('Provide one of token or username/password.')
 
+        self.timeout = timeout
+        self.latencies = []
+        self.cache_ttls = dict(DEFAULT_CACHE_TTLS, **(cache_ttls or {}))
+        self._cache = {}
+        self._cache_locks = {}
+        self._indexes = {}
+        self.session = self._create_session(pool_size, retries, backoff)
+
         if not token and username and password:
             result = self.login(username, password, headers={'Content-type': 'application/json'})
             if not result.get('token'):
@@ -32,11 +77,91 @@ class API:
         :param headers: (optional) Custom headers for this request
         :return: The result parsed to a JSON dictionary.
         """
+        if not (method == 'get' and self.cache_ttls.get(method_name)):
+            return self._request(method_name, method, json, headers)
+
+        # one fetch per endpoint, also when called from concurrent threads
+        with self._cache_locks.setdefault(method_name, threading.Lock()):
+            expires, result = self._cache.get(method_name, (0, None))
+            if time.monotonic() < expires:
+                return result
+
+            result = self._request(method_name, method, json, headers)
+            self._cache[method_name] = (time.monotonic() + self.cache_ttls[method_name], result)
+            return result
+
+    def _request(self, method_name, method, json, headers):
         url = f'https://{API_HOST}{API_BASE_URI}{method_name}'
         headers = headers or self.headers
-        response = requests.request(method, url, json=json, headers=headers)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, json=json, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ApiException(str(e), method_name)
+        finally:
+            self.latencies.append((method.upper(), method_name, time.perf_counter() - start))
         return self._check_response(method_name, response)
 
+    def get_index(self, method_name):
+        """
+        Get the index of a list response. The index is built once per (cached) response.
+        :param method_name: Name of the API list method (E.g. '/app/list/')
+        :return: Index
+        """
+        response = self.request(method_name)
+        cached = self._indexes.get(method_name)
+        if cached and cached[0] is response:
+            return cached[1]
+
+        if isinstance(response, dict):
+            records = response.get(LIST_KEYS[method_name], [])
+        else:
+            records = response
+
+        index = Index(records, INDEX_FIELDS)
+        self._indexes[method_name] = (response, index)
+        return index
+
+    def invalidate(self, method_name=None):
+        """
+        Drop cached responses.
+        :param method_name: (optional) API method to invalidate (E.g. '/app/list/'), default: all
+        """
+        if method_name is None:
+            self._cache.clear()
+            self._indexes.clear()
+        else:
+            self._cache.pop(method_name, None)
+            self._indexes.pop(method_name, None)
+
+    def close(self):
+        """
+        Close the pooled connections of the session.
+        """
+        self.session.close()
+
+    def __copy__(self):
+        # copies of a config (eg. for tasks running in parallel) share the client, its session and cache
+        return self
+
+    @staticmethod
+    def _create_session(pool_size, retries, backoff):
+        """
+        Create a keep-alive session with a connection pool and retry policy,
+        shared by all requests to the API host.
+        :param pool_size: Max number of pooled connections
+        :param retries: Number of retries on connection errors and 5xx responses
+        :param backoff: Backoff factor between retries, in seconds
+        :return: requests.Session
+        """
+        retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount(f'https://{API_HOST}', adapter)
+        return session
+
     def _check_response(self, method_name, response):
         """
         Checks whether `result` is a valid API response.
@@ -94,6 +219,14 @@ class API:
         method_url = '/osuser/list/'
         return self.request(method_url)
 
+    def find_user(self, user_name):
+        """
+        Find a user by name.
+        :param user_name: Name of the user
+        :return: User record from the user list, or None when not found
+        """
+        return self.get_index('/osuser/list/').get('name', user_name)
+
     def get_user_info(self, user_id):
         """
         Get info for a user.
@@ -124,9 +257,19 @@ class API:
                 'default_password': 'password1'
             }
         """
+        return self.add_users([{'name': user_name, 'password': password, 'server': server_id}])
+
+    def add_users(self, users):
+        """
+        Add users in a single request.
+        :param users: List of dictionaries with name, password and server (UUID) of each user
+        :return: API Response, see `add_user`
+        """
         method_url = '/osuser/create/'
-        payload = [{'json': {}, 'name': user_name, 'password': password, 'server': server_id}]
-        return self.request(method_url, json=payload, method='post')
+        payload = [dict({'json': {}}, **user) for user in users]
+        result = self.request(method_url, json=payload, method='post')
+        self.invalidate('/osuser/list/')
+        return result
 
     def get_servers(self):
         """
@@ -151,6 +294,14 @@ class API:
         method_url = '/server/list/'
         return self.request(method_url)
 
+    def find_server(self, hostname):
+        """
+        Find a web server by host name.
+        :param hostname: Host name of the server (E.g. 'opal1.opalstack.com')
+        :return: Server record from the web server list, or None when not found
+        """
+        return self.get_index('/server/list/').get('hostname', hostname)
+
     def get_apps(self):
         """
         Retrieve list of apps.
@@ -176,6 +327,14 @@ class API:
         method_url = '/app/list/'
         return self.request(method_url)
 
+    def find_app(self, app_name):
+        """
+        Find an app by name.
+        :param app_name: Name of the app
+        :return: App record from the app list, or None when not found
+        """
+        return self.get_index('/app/list/').get('name', app_name)
+
     def get_app_info(self, app_id):
         """
         Get info of an app.
@@ -222,10 +381,19 @@ class API:
                 }
             ]
         """
+        return self.add_apps([{'type': app_type, 'name': app_name, 'osuser': user_id}])
+
+    def add_apps(self, apps):
+        """
+        Create new apps in a single request.
+        :param apps: List of dictionaries with type, name and osuser (UUID) of each app
+        :return: API Response: list of created apps, see `add_app`
+        """
         method_url = '/app/create/'
-        payload = [{'json': {}, 'type': app_type, 'name': app_name,
-                   'osuser': user_id}]
-        return self.request(method_url, json=payload, method='post')
+        payload = [dict({'json': {}}, **app) for app in apps]
+        result = self.request(method_url, json=payload, method='post')
+        self.invalidate('/app/list/')
+        return result
 
     def get_psqls(self):
         """
@@ -250,6 +418,14 @@ class API:
         method_url = '/psqldb/list/'
         return self.request(method_url)
 
+    def find_psql(self, db_name):
+        """
+        Find a postgres database by name.
+        :param db_name: Name of the database
+        :return: Database record from the database list, or None when not found
+        """
+        return self.get_index('/psqldb/list/').get('name', db_name)
+
     def get_psql_info(self, db_id):
         """
         Get info for a postgres database.
@@ -306,6 +482,14 @@ class API:
         method_url = '/mariadb/list/'
         return self.request(method_url)
 
+    def find_mariadb(self, db_name):
+        """
+        Find a maria database by name.
+        :param db_name: Name of the database
+        :return: Database record from the database list, or None when not found
+        """
+        return self.get_index('/mariadb/list/').get('name', db_name)
+
     def get_mariadb_info(self, db_id):
         method_url = f'/mariadb/read/{db_id}'
         return self.request(method_url)
@@ -323,9 +507,19 @@ class API:
         :return: API Response:
             ...
         """
+        return self.add_psqls([{'name': name, 'server': server_id, 'charset': charset}])
+
+    def add_psqls(self, dbs):
+        """
+        Create postgres databases in a single request.
+        :param dbs: List of dictionaries with name, server (UUID) and optional charset of each db
+        :return: API Response
+        """
         method_url = '/psqldb/create/'
-        payload = [{'name': name, 'server': server_id, 'charset': charset}]
-        return self.request(method_url, json=payload, method='post')
+        payload = [dict({'charset': 'utf8'}, **db) for db in dbs]
+        result = self.request(method_url, json=payload, method='post')
+        self.invalidate('/psqldb/list/')
+        return result
 
     def add_mariadb(self, name, server_id, charset):
         """
@@ -343,10 +537,90 @@ class API:
                 "owner": "dbuser1"
             }
         """
+        return self.add_mariadbs([{'name': name, 'server': server_id, 'charset': charset}])
+
+    def add_mariadbs(self, dbs):
+        """
+        Create maria databases in a single request.
+        :param dbs: List of dictionaries with name, server (UUID) and optional charset of each db
+        :return: API Response
+        """
         method_url = '/mariadb/create/'
         # untested payload...
-        payload = [{'name': name, 'server': server_id, 'charset': charset}]
-        return self.request(method_url, json=payload, method='post')
+        payload = [dict({'charset': 'utf8'}, **db) for db in dbs]
+        result = self.request(method_url, json=payload, method='post')
+        self.invalidate('/mariadb/list/')
+        return result
+
+
+class AsyncAPI:
+    """
+    Asyncio sibling of `API` with the same method surface: every public method of
+    `API` is available as a coroutine. Calls run on a thread pool over the pooled
+    session (and cache) of the wrapped `API`, at most `concurrency` at a time.
+
+        api = AsyncAPI(api)
+        app, user = await asyncio.gather(api.find_app('app1'), api.find_user('user1'))
+    """
+    def __init__(self, api=None, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        self.api = api or API(**kwargs)
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = (None, None)
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            # a semaphore is bound to an event loop, (re)create it for the running loop
+            loop = asyncio.get_running_loop()
+            if self._semaphore[0] is not loop:
+                self._semaphore = (loop, asyncio.Semaphore(self.concurrency))
+            async with self._semaphore[1]:
+                return await loop.run_in_executor(self._executor, functools.partial(attr, *args, **kwargs))
+        return method
+
+    def close(self):
+        """
+        Shut down the thread pool. The wrapped `API` stays usable.
+        """
+        self._executor.shutdown(wait=False)
+
+
+class Index:
+    """
+    Lookup table for the records of a list response, keyed by one or more record fields.
+    Built once, after which every lookup is a dictionary access instead of a scan of the list.
+    """
+    def __init__(self, records, fields):
+        self.records = records
+        self._maps = {field: {} for field in fields}
+        for rec in records:
+            for field, mapping in self._maps.items():
+                value = rec.get(field)
+                if value is not None:
+                    mapping.setdefault(value, []).append(rec)
+
+    def get(self, field, value):
+        """
+        Get the first record with `field` equal to `value`.
+        :return: Record or None when not found
+        """
+        found = self._maps[field].get(value)
+        return found[0] if found else None
+
+    def filter(self, field, value):
+        """
+        Get all records with `field` equal to `value` (E.g. all apps of an osuser).
+        :return: List of records
+        """
+        return list(self._maps[field].get(value, []))
+
+    def __len__(self):
+        return len(self.records)
 
 
 class ApiException(Exception):
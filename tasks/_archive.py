@@ -0,0 +1,163 @@
+"""
+Compressed tar archives of local files, extracted on remote: picking a compressor available on
+both ends (see CODECS and transfer_codec), streaming tars through it and hashing local files
+to find the ones that changed since an upload.
+"""
+import fnmatch
+import hashlib
+import os
+import subprocess
+import tarfile
+import threading
+
+from ._constants import *
+
+# compressors for archives, in order of preference. pigz and gzip are compatible.
+CODECS = {
+    'zstd': {'ext': 'zst', 'compress': 'zstd -q -{level} -T{threads}', 'decompress': 'zstd -q -d', 'level': 3},
+    'pigz': {'ext': 'gz', 'compress': 'pigz -{level} -p {threads}', 'decompress': 'pigz -d', 'level': 6},
+    'gzip': {'ext': 'gz', 'compress': 'gzip -{level}', 'decompress': 'gzip -d', 'level': 6},
+}
+
+
+def available_codecs(c, local=False):
+    """
+    Probe a host for compressors, result is cached in config.
+    :param local: Probe local host instead of remote
+    :return: List of available codec names
+    """
+    key = 'local_codecs' if local else 'remote_codecs'
+    if c.config.data.get(key) is None:
+        command = f'command -v {" ".join(CODECS)}'
+        if local:
+            result = c.local(command, env={'PATH': '/usr/bin:/bin'}, hide=True, warn=True)
+        else:
+            result = c.run(command, hide=True, warn=True)
+        found = {path.split('/')[-1] for path in result.stdout.split()}
+        c.config.data[key] = [name for name in CODECS if name in found]
+    return list(c.config.data[key])
+
+
+def pick_codec(c, available):
+    """
+    Pick configured codec (compression.codec), or the preferred available one for 'auto'.
+    Falls back to gzip.
+    """
+    configured = c.config.compression.get('codec') or 'auto'
+    if configured != 'auto':
+        if configured in available:
+            return configured
+        print(f'{YELLOW}Compressor {configured} not available, falling back.{COL_END}')
+    return next((name for name in CODECS if name in available), 'gzip')
+
+
+def compress_command(c, codec):
+    """
+    Command compressing stdin to stdout, with configured level and threads (0: all cores).
+    """
+    level = c.config.compression.get('level') or CODECS[codec]['level']
+    threads = c.config.compression.get('threads') or 0
+    command = CODECS[codec]['compress'].format(level=level, threads=threads)
+    if codec == 'pigz' and not threads:
+        # pigz uses all cores by default
+        command = command.replace(' -p 0', '')
+    return command
+
+
+def decompress_command(ext, available):
+    """
+    Command decompressing stdin to stdout for an archive with given extension, None if not available.
+    """
+    return next((CODECS[name]['decompress'] for name in CODECS
+                 if name in available and CODECS[name]['ext'] == ext), None)
+
+
+def transfer_codec(c):
+    """
+    Pick codec for archives created locally and extracted on remote.
+    :return: Tuple of codec name (for local compression) and remote decompress command
+    """
+    local = available_codecs(c, local=True)
+    remote = available_codecs(c)
+    # any gzip compressor works for any gzip decompressor
+    usable = [name for name in local if decompress_command(CODECS[name]['ext'], remote)]
+    codec = pick_codec(c, usable)
+    return codec, decompress_command(CODECS[codec]['ext'], remote) or 'gzip -d'
+
+
+def compressed_tar(c, codec, fileobj, add):
+    """
+    Write a tar stream, built by add(tar), compressed by a local codec process to fileobj.
+    """
+    # exec: the compressor is the process, not a shell running it (see kill below)
+    process = subprocess.Popen(f'exec {compress_command(c, codec)}', shell=True, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, env=dict(os.environ, PATH='/usr/bin:/bin'))
+    errors = []
+
+    def produce():
+        try:
+            with tarfile.open(fileobj=process.stdin, mode='w|') as tar:
+                add(tar)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                # compressor killed, see below
+                pass
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        for block in iter(lambda: process.stdout.read(1024 * 1024), b''):
+            fileobj.write(block)
+    except BaseException:
+        # fileobj failed (eg. remote exited): nothing reads the compressor anymore, stop it and the producer
+        process.kill()
+        process.stdout.close()
+        producer.join()
+        process.wait()
+        raise
+    producer.join()
+    if errors:
+        raise errors[0]
+    if process.wait() != 0:
+        raise RuntimeError(f'Compressing with {codec} failed')
+
+
+def excluded(path, excludes):
+    """
+    Match path like tar --exclude: against the full path and each of its components.
+    """
+    parts = path.split('/')
+    return any(fnmatch.fnmatch(path, e) or any(fnmatch.fnmatch(p, e) for p in parts) for e in excludes)
+
+
+def local_manifest(fab_path, source, excludes):
+    """
+    Hash local source files.
+    :return: Dictionary of path (relative to fab_path) and [sha256, size] of each file
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(os.path.join(fab_path, source)):
+        rel_root = os.path.relpath(root, fab_path)
+        dirs[:] = [d for d in dirs if not excluded(f'{rel_root}/{d}', excludes)]
+        for name in files:
+            path = f'{rel_root}/{name}'
+            if excluded(path, excludes):
+                continue
+
+            full_path = os.path.join(root, name)
+            if os.path.islink(full_path):
+                # tar keeps links as links: hash the link itself
+                target = os.readlink(full_path).encode()
+                manifest[path] = [hashlib.sha256(target).hexdigest(), len(target)]
+                continue
+
+            h = hashlib.sha256()
+            with open(full_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            manifest[path] = [h.hexdigest(), os.path.getsize(full_path)]
+    return manifest
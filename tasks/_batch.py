@@ -0,0 +1,81 @@
+"""
+Run a group of remote commands as one script, in a single round trip, instead of a
+c.run (a new channel) per command. Each command still gets its own result, with exit
+status and output, so callers can keep handling errors per command:
+
+    with Batch(c) as b:
+        result = b.run('ln -sf ...')
+        b.run('test -d ~/opt', warn=True)
+    print(result.ok, result.stdout)
+
+Commands run in order, each in a subshell (a `cd` does not affect later commands).
+Like c.run, a failing command without `warn` stops the batch and raises UnexpectedExit.
+"""
+import base64
+import io
+import uuid
+
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result
+
+from ._constants import *
+
+
+class Batch:
+
+    def __init__(self, c):
+        self.c = c
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def run(self, command, warn=False, hide=False, echo=False):
+        """
+        Add a command to the batch.
+        :return: Result, filled in when the batch is flushed
+        """
+        result = Result(command=command, exited=-1, hide=('stdout', 'stderr') if hide else ())
+        self.commands.append((command, warn, echo, result))
+        return result
+
+    def flush(self):
+        """
+        Run all added commands in one remote script and fill in their results.
+        """
+        commands, self.commands = self.commands, []
+        if not commands:
+            return
+
+        marker = f'@@batch-{uuid.uuid4().hex}'
+        lines = ['d=$(mktemp -d)', 'trap \'rm -rf "$d"\' EXIT']
+        for i, (command, warn, _, _) in enumerate(commands):
+            lines.append(f'(\n{command}\n) >"$d/out" 2>"$d/err" </dev/null; rc=$?')
+            lines.append(f'echo "{marker} {i} $rc $(base64 -w0 "$d/out") $(base64 -w0 "$d/err")"')
+            if not warn:
+                lines.append('[ $rc -eq 0 ] || exit 0')
+
+        output = self.c.run('bash -s', in_stream=io.StringIO('\n'.join(lines) + '\n'), hide=True).stdout
+        for line in output.splitlines():
+            if not line.startswith(marker):
+                continue
+            _, i, exited, out, err = (line.split(' ') + ['', ''])[:5]
+            command, warn, echo, result = commands[int(i)]
+            result.exited = int(exited)
+            result.stdout = _decode(out)
+            result.stderr = _decode(err)
+            if echo:
+                print(f'{WHITE}{command}{COL_END}')
+            if 'stdout' not in result.hide:
+                print(result.stdout, end='')
+                print(result.stderr, end='')
+            if not result.ok and not warn:
+                raise UnexpectedExit(result)
+
+
+def _decode(value):
+    return base64.b64decode(value).decode(errors='replace') if value else ''
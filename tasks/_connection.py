@@ -0,0 +1,102 @@
+"""
+One SSH connection per host for a whole run: all tasks (and a resumed journal) share it,
+commands run on channels of its transport, and file transfers use SFTP over the same
+transport instead of separate scp processes. Handshake and transfer times are recorded.
+"""
+import os
+import threading
+import time
+
+from fabric import Connection
+
+from ._constants import *
+
+_connections = {}
+_lock = threading.Lock()
+
+
+class TimedConnection(Connection):
+    """
+    Connection recording its handshake time and transfers (direction, path, bytes, seconds).
+    Opening and starting SFTP are serialized, tasks running in parallel share the connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # plain attributes, not config (see invoke's DataProxy)
+        self._set(handshake=None, transfers=[], _open_lock=threading.RLock())
+
+    def open(self):
+        with self._open_lock:
+            if self.is_connected:
+                return None
+            start = time.perf_counter()
+            result = super().open()
+            self._set(handshake=time.perf_counter() - start)
+            print(f'{BLUE}Connected to {self.host} in {self.handshake:.2f}s{COL_END}')
+            return result
+
+    def sftp(self):
+        with self._open_lock:
+            return super().sftp()
+
+    def put(self, *args, **kwargs):
+        return self._transfer('put', super().put, *args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._transfer('get', super().get, *args, **kwargs)
+
+    def _transfer(self, direction, method, *args, **kwargs):
+        start = time.perf_counter()
+        result = method(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        # local is a path or a file-like object
+        if isinstance(result.local, str):
+            size = os.path.getsize(result.local)
+        else:
+            size = len(result.local.getvalue()) if hasattr(result.local, 'getvalue') else 0
+        self.transfers.append((direction, result.remote, size, seconds))
+        return result
+
+
+def connect(c, host):
+    """
+    Get the connection of this run to host, created on first use. Connecting is lazy.
+    :return: TimedConnection
+    """
+    with _lock:
+        if host not in _connections:
+            _connections[host] = TimedConnection(host, config=c.config)
+        return _connections[host]
+
+
+def bind(connection, config):
+    """
+    The same connection (transport, SFTP session and timings), with another config.
+    Used for tasks running in parallel, each with its own copy of the config.
+    """
+    connection.open()
+    bound = TimedConnection(connection.host, user=connection.user, port=connection.port, config=config)
+    bound._set(client=connection.client, transport=connection.transport, transfers=connection.transfers,
+               handshake=connection.handshake, _open_lock=connection._open_lock, _sftp=connection.sftp())
+    return bound
+
+
+def report():
+    """
+    Print handshake and transfer times of the connections of this run.
+    """
+    for host, connection in _connections.items():
+        if connection.handshake is None:
+            continue
+
+        print(f'{CYAN}SSH {host}: handshake {connection.handshake:.2f}s, '
+              f'{len(connection.transfers)} transfers{COL_END}')
+        for direction, path, size, seconds in connection.transfers:
+            print(f'  {direction:<4} {path:<60} {size / 1e6:8.2f} MB {seconds:7.2f}s')
+
+        size = sum(x[2] for x in connection.transfers)
+        seconds = sum(x[3] for x in connection.transfers)
+        if seconds:
+            print(f'{GREEN}Transferred {size / 1e6:.1f} MB in {seconds:.1f}s: '
+                  f'{size / 1e6 / seconds:.1f} MB/s{COL_END}')
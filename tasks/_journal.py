@@ -0,0 +1,122 @@
+"""
+Local journal of a run: every completed task is recorded together with the
+config data it produced, so a failed install or deploy can be resumed at the
+failed step, without redoing (remote) work for the steps already done.
+"""
+import json
+import os
+import threading
+import time
+from os.path import dirname
+
+from fabric import Connection
+
+from ._connection import connect
+from ._constants import *
+
+# results stored outside of config.data by find_bin tasks
+CONFIG_KEYS = ['python_app', 'pip_app', 'redis_cli', 'redis_server']
+
+
+class Journal:
+
+    def __init__(self, c, name):
+        """
+        :param c:
+        :param name: Name of the run, eg. 'install' or 'deploy'
+        """
+        # stored next to fabric.yml
+        fab_path = dirname(c.config._runtime_path or '') or '.'
+        self.path = os.path.join(fab_path, f'.{c.config.project.name}.{name}.journal.json')
+        self.name = name
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load journal of a previous (failed) run.
+        :return: False when there is nothing to resume, True otherwise
+        """
+        if not os.path.exists(self.path):
+            print(f'{YELLOW}No journal found at {self.path}, starting from the beginning.{COL_END}')
+            return False
+
+        with open(self.path) as f:
+            self.entries = json.load(f)['completed']
+
+        print(f'{CYAN}Resuming {self.name}: {len(self.entries)} completed tasks in {self.path}{COL_END}')
+        return True
+
+    def clear(self):
+        """
+        Start with an empty journal, removing the journal of a previous run.
+        """
+        self.entries = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def completed(self, t):
+        return any(x['task'] == _name(t) for x in self.entries)
+
+    def restore(self, c):
+        """
+        Rehydrate config from the journal.
+        :return: Connection when a completed task returned one, else `c`
+        """
+        if not self.entries:
+            return c
+
+        last = self.entries[-1]
+        for key, value in last['data'].items():
+            c.config.data[key] = value
+        for key, value in last['config'].items():
+            c.config[key] = value
+
+        host = next((x['connection'] for x in reversed(self.entries) if x['connection']), None)
+        if host:
+            # connecting is lazy, nothing is contacted here
+            c = connect(c, host)
+        return c
+
+    def record(self, c, t, result, seconds):
+        """
+        Record a completed task with a snapshot of the config it produced.
+        """
+        entry = {
+            'task': _name(t),
+            'seconds': round(seconds, 3),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'connection': result.host if isinstance(result, Connection) else None,
+            'data': json.loads(json.dumps(dict(c.config.data), default=_plain)),
+            'config': {key: c.config[key] for key in CONFIG_KEYS if c.config.get(key)},
+        }
+        with self._lock:
+            self.entries.append(entry)
+            self._write()
+
+    def finish(self, ok):
+        """
+        Remove journal after a successful run, keep it for --resume otherwise.
+        """
+        if ok:
+            self.clear()
+        else:
+            print(f'{YELLOW}Run {self.name} with --resume to continue from the failed task.{COL_END}')
+
+    def _write(self):
+        # data holds passwords, keep it private
+        tmp_path = f'{self.path}.tmp'
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'run': self.name, 'completed': self.entries}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def _name(t):
+    return f'{t.__module__}.{t.__name__}'
+
+
+def _plain(value):
+    # nested config values are DataProxy objects
+    if hasattr(value, '_config'):
+        return dict(value._config)
+    return str(value)
@@ -0,0 +1,126 @@
+"""
+Releases (project.upload: release): every upload is a new dir in app_path/releases, built on
+remote by scripts/build_release.py from a content store of files named by hash, and src is a
+symlink to the current release. Rolling back switches the symlink to the previous release.
+"""
+import io
+import os
+from os.path import dirname
+
+from . import _archive, scripts
+from ._constants import *
+
+DEFAULT_KEEP_RELEASES = 5
+
+
+def upload(c):
+    """
+    Uploads files not yet in the remote content store (app_path/store, files named by hash),
+    builds a new release in app_path/releases by hardlinking the store files and switches
+    the src symlink to it. Only changed files are transferred and take disk space.
+    """
+    app_path = c.config.data.app_path
+    store_path = f'{app_path}/store'
+
+    print(f'{CYAN}Uploading release of project {c.config.project.name}...{COL_END}')
+    fab_path = dirname(c.config._runtime_path)
+    local = _archive.local_manifest(fab_path, c.config.project.source, c.config.archive_excludes)
+
+    # file entries refer to the store by hash and mode (hardlinks share their mode)
+    listing = []
+    blobs = {}
+    for path, (digest, _) in sorted(local.items()):
+        full_path = os.path.join(fab_path, path)
+        if os.path.islink(full_path):
+            listing.append(f'L\t{os.readlink(full_path)}\t{path}')
+        else:
+            blob = f'{digest}-{os.stat(full_path).st_mode & 0o777:o}'
+            blobs.setdefault(blob, full_path)
+            listing.append(f'F\t{blob}\t{path}')
+
+    c.run(f'mkdir -p {store_path} {app_path}/releases')
+    result = c.run(f'ls {store_path}', hide=True)
+    missing = set(blobs) - set(result.stdout.split())
+    print(f'{len(missing)} new files, {len(blobs) - len(missing)} files in store.')
+
+    if missing:
+        codec, decompress = _archive.transfer_codec(c)
+        file_name = f'{c.config.project.name}.store.tar.{_archive.CODECS[codec]["ext"]}'
+
+        def add(tar):
+            for blob in sorted(missing):
+                tar.add(blobs[blob], arcname=blob)
+
+        with open(f'/tmp/{file_name}', 'wb') as f:
+            _archive.compressed_tar(c, codec, f, add)
+        c.put(f'/tmp/{file_name}', f'{app_path}/{file_name}')
+        os.remove(f'/tmp/{file_name}')
+        c.run(f'set -o pipefail && cd {app_path} && {decompress} < {file_name} | tar -xf - -C {store_path} '
+              f'&& rm {file_name}')
+
+    # build release
+    c.put(scripts.path('build_release'), f'{app_path}/.build_release.py')
+    c.put(io.StringIO('\n'.join(listing) + '\n'), f'{app_path}/.release.list')
+    result = c.run(f'cd {app_path} && python3 .build_release.py {store_path} releases .release.list '
+                   f'&& rm .release.list', hide=True)
+    release = result.stdout.strip()
+
+    switch(c, release)
+    prune(c)
+    return True
+
+
+def switch(c, release):
+    """
+    Atomically point the src symlink to the given release.
+    """
+    app_path = c.config.data.app_path
+    src_dir = c.config.data.src_path.split('/')[-1]
+
+    # first release: src is a directory from a previous archive upload
+    c.run(f'cd {app_path} && if [ -d {src_dir} ] && [ ! -L {src_dir} ]; then rm -rf {src_dir}; fi')
+    c.run(f'cd {app_path} && ln -sfn releases/{release}/{src_dir} {src_dir}.new && mv -Tf {src_dir}.new {src_dir}')
+    print(f'{GREEN}Switched {src_dir} to release {release}{COL_END}')
+
+
+def list_releases(c):
+    """
+    :return: Tuple of list of release names (oldest first) and the current release
+    """
+    app_path = c.config.data.app_path
+    src_dir = c.config.data.src_path.split('/')[-1]
+    result = c.run(f'cd {app_path} && ls releases && echo "-> $(readlink {src_dir})"', hide=True, warn=True)
+    lines = result.stdout.split()
+    current = lines[-1].split('/')[1] if lines and lines[-1].startswith('releases/') else None
+    releases = sorted(x for x in lines if x.isdigit())
+    return releases, current
+
+
+def prune(c):
+    """
+    Remove old releases, keep project.keep_releases, and files in store no longer used by any release.
+    """
+    keep = int(c.config.project.get('keep_releases') or DEFAULT_KEEP_RELEASES)
+    releases, current = list_releases(c)
+    old = [x for x in releases[:-keep] if x != current]
+    if not old:
+        return
+
+    app_path = c.config.data.app_path
+    print(f'Removing releases: {", ".join(old)}')
+    c.run(f'cd {app_path}/releases && rm -rf {" ".join(old)}')
+    # store files with a single link are not used by any release anymore
+    c.run(f'find {app_path}/store -type f -links 1 -delete')
+
+
+def restore(c):
+    """
+    Switch src back to the release before the current one.
+    """
+    releases, current = list_releases(c)
+    if current not in releases or releases.index(current) == 0:
+        print(f'{RED}Could not find a release before {current}{COL_END}')
+        return False
+
+    switch(c, releases[releases.index(current) - 1])
+    return True
@@ -0,0 +1,199 @@
+"""
+Run a list of tasks as a graph: tasks that declare what they need and provide
+(in c.config.data, or a pseudo key like 'connection') run as soon as the earlier
+tasks they depend on are done, in parallel on a thread pool (with scheduler.workers > 1).
+Undeclared and interactive tasks run on their own, after all earlier tasks and before all
+later tasks. A task running in parallel gets its own copy of the config: the scheduler
+writes its changes back when it's done, so the shared config is only written by the scheduler.
+"""
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from fabric import Connection
+
+from . import _connection
+from ._constants import *
+
+DEFAULT_WORKERS = 1
+
+_lock = threading.Lock()
+_MISSING = object()
+
+
+def declare(needs=(), provides=(), always=False, interactive=False):
+    """
+    Declare the data a task needs and provides.
+    A need only waits for earlier tasks in the list that provide it, unprovided needs are ignored.
+    Tasks with `always` are run again when resuming from a journal (eg. login: an API
+    client can't be stored).
+    Tasks with `interactive` (using a pty or reading input) never run in parallel with other tasks.
+
+        @declare(needs=['connection', 'src_path'], provides=['src'])
+        def upload(c):
+            ...
+    """
+    def decorator(func):
+        func.needs = frozenset(needs)
+        func.provides = frozenset(provides)
+        func.always = always
+        func.interactive = interactive
+        return func
+    return decorator
+
+
+def execute(c, tasks, workers=DEFAULT_WORKERS, journal=None):
+    """
+    Execute tasks, stop at the first falsy result or exception and print a timing report.
+    A task returning a Connection replaces `c` for all tasks started after it.
+    :param workers: Max number of tasks running in parallel, 1 runs all tasks one by one
+    :param journal: (optional) Journal to record completed tasks in. Tasks completed
+        in the journal (loaded for resume) are skipped and their config is restored.
+    :return: Last connection (or context) on success, None on error
+    """
+    dependencies = _dependencies(tasks)
+    pending = list(range(len(tasks)))
+    running = {}
+    done = set()
+    timings = {}
+    failed = False
+
+    if journal:
+        c = journal.restore(c)
+        for i, t in enumerate(tasks):
+            if journal.completed(t) and not getattr(t, 'always', False):
+                print(f'{BLUE}Skipping {t.__module__}.{t.__name__}: completed in journal{COL_END}')
+                pending.remove(i)
+                done.add(i)
+
+    def finish(i, result):
+        nonlocal c, failed
+        done.add(i)
+        if not result:
+            failed = True
+            return
+        if isinstance(result, Connection):
+            c = result
+        if journal:
+            journal.record(c, tasks[i], result, timings[i])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while (pending and not failed) or running:
+            ready = [] if failed else [i for i in pending if dependencies[i] <= done]
+            alone = [i for i in ready if workers == 1 or _alone(tasks[i])]
+            if alone:
+                # wait for running tasks, then run it in this thread with the shared config
+                if not running:
+                    i = alone[0]
+                    pending.remove(i)
+                    result, timings[i] = _run(c, tasks[i])
+                    finish(i, result)
+                    continue
+            else:
+                for i in ready:
+                    pending.remove(i)
+                    context, start_values = _task_context(c)
+                    running[executor.submit(_run, context, tasks[i])] = (i, context, start_values)
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i, context, start_values = running.pop(future)
+                result, timings[i] = future.result()
+                _merge(c.config, context.config, start_values)
+                finish(i, result)
+
+    _report(tasks, timings, time.perf_counter() - start)
+    if journal:
+        journal.finish(not failed)
+    return None if failed else c
+
+
+def _alone(t):
+    # undeclared tasks are barriers anyway, see _dependencies
+    return getattr(t, 'needs', None) is None or getattr(t, 'interactive', False)
+
+
+def _task_context(c):
+    """
+    Context for a task running in parallel: same connection, copy of the config.
+    :return: Tuple of context and the values of its config at the start, see _merge
+    """
+    with _lock:
+        config = c.config.clone()
+        start_values = _values(config)
+    if isinstance(c, _connection.TimedConnection):
+        return _connection.bind(c, config), start_values
+    return type(c)(config=config), start_values
+
+
+def _values(values):
+    """
+    Copy of config values: dicts are copied recursively, other values like the config does (copy.copy).
+    """
+    return {key: _values(value) if isinstance(value, dict) else copy.copy(value) for key, value in values.items()}
+
+
+def _merge(target, source, start_values):
+    """
+    Write the values a task changed in its copy of the config (source, compared to its
+    start_values) to the shared config, leaving changes of other tasks in place.
+    """
+    with _lock:
+        _merge_values(target, source, start_values)
+
+
+def _merge_values(target, source, start_values):
+    for key, value in source.items():
+        before = start_values.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(before, dict) and isinstance(target.get(key), dict):
+            # a nested DataProxy, writing to it writes to the config
+            _merge_values(target[key], value, before)
+        elif before is _MISSING or before != value:
+            target[key] = value
+
+
+def _dependencies(tasks):
+    """
+    Map each task (index) to the set of earlier tasks (indices) it has to wait for.
+    """
+    dependencies = {}
+    for i, t in enumerate(tasks):
+        needs = getattr(t, 'needs', None)
+        if needs is None:
+            # undeclared: wait for everything before
+            dependencies[i] = set(range(i))
+            continue
+
+        dependencies[i] = {
+            j for j, earlier in enumerate(tasks[:i])
+            if getattr(earlier, 'needs', None) is None or needs & earlier.provides
+        }
+    return dependencies
+
+
+def _run(c, t):
+    """
+    Run a single task.
+    :return: Tuple of result (None on exception) and duration in seconds
+    """
+    print(f'\n------------------------------------------------------')
+    print(f'{YELLOW}Executing {t.__module__}.{t.__name__}{COL_END}\n')
+    start = time.perf_counter()
+    try:
+        result = t(c)
+    except Exception as e:
+        print(f'{RED}{t.__module__}.{t.__name__}: {e}{COL_END}')
+        result = None
+    return result, time.perf_counter() - start
+
+
+def _report(tasks, timings, wall_time):
+    print(f'\n------------------------------------------------------')
+    print(f'{CYAN}Task timings:{COL_END}')
+    for i, seconds in sorted(timings.items()):
+        name = f'{tasks[i].__module__}.{tasks[i].__name__}'
+        print(f'  {name:<40} {seconds:8.2f}s')
+    print(f'{GREEN}{len(timings)} tasks in {wall_time:.2f}s '
+          f'(sum of task times: {sum(timings.values()):.2f}s){COL_END}')
@@ -0,0 +1,63 @@
+"""
+Incremental snapshots of the remote src dir (project.backup: snapshot), taken and restored on
+remote by scripts/snapshot.py, which is uploaded to the backup dir before each run.
+"""
+import json
+import time
+
+from . import scripts
+from ._constants import *
+
+DEFAULT_KEEP_SNAPSHOTS = 5
+
+
+def backup(c):
+    """
+    Create an incremental snapshot of the remote src dir and remove snapshots beyond project.keep_snapshots.
+    """
+    print(f'{CYAN}Creating snapshot of remote project...{COL_END}')
+    start = time.perf_counter()
+    excludes = json.dumps(list(c.config.archive_excludes))
+    result = _run_script(c, 'snapshot', c.config.data.src_path, excludes)
+    snapshot_id, files, new = result.stdout.split()
+    print(f'{GREEN}Snapshot {snapshot_id}: {files} files, {new} new, in {time.perf_counter() - start:.1f}s{COL_END}')
+
+    keep = int(c.config.project.get('keep_snapshots') or DEFAULT_KEEP_SNAPSHOTS)
+    result = _run_script(c, 'prune', keep)
+    snapshots, chunks = result.stdout.split()
+    if int(snapshots):
+        print(f'Removed {snapshots} old snapshots and {chunks} unused chunks.')
+    return True
+
+
+def restore(c):
+    """
+    Restore src dir from a snapshot, default the latest.
+    """
+    snapshot_id = c.config.data.get('restore_snapshot') or 'latest'
+    print(f'{CYAN}Restoring snapshot {snapshot_id} of remote project...{COL_END}')
+    result = _run_script(c, 'restore', c.config.data.src_path, snapshot_id, warn=True)
+    if not result.ok:
+        print(f'{RED}{result.stderr.strip()}{COL_END}')
+        return False
+
+    print(f'{GREEN}Restored snapshot {result.stdout.strip()}{COL_END}')
+    return True
+
+
+def listing(c):
+    """
+    :return: Lines of snapshot id, number of files and bytes, oldest first
+    """
+    return _run_script(c, 'list').stdout
+
+
+def _run_script(c, command, *args, **kwargs):
+    """
+    Run a command of scripts/snapshot.py on remote.
+    """
+    backup_path = c.config.data.backup_path
+    c.run(f'mkdir -p {backup_path}')
+    c.put(scripts.path('snapshot'), f'{backup_path}/.snapshot.py')
+    args = ' '.join(f"'{x}'" for x in args)
+    return c.run(f'python3 {backup_path}/.snapshot.py {command} {backup_path} {args}', hide=True, **kwargs)
@@ -0,0 +1,141 @@
+"""
+Static files: built locally and uploaded (project.static: local, see upload), or fingerprinted
+on remote to skip collectstatic and compress when nothing changed (see files).
+"""
+import io
+import json
+import os
+import sys
+import time
+from os.path import dirname
+
+from . import _archive, scripts, virtual_env
+from ._constants import *
+
+# static files and templates (compress), changes are tracked in STATIC_MANIFEST in app_path
+STATIC_MANIFEST = '.static.manifest.json'
+# marks the start of the files of a dir in the output of files
+STATIC_DIR_MARKER = '@@static-dir'
+# prints the dirs of Django's staticfiles finders and template engines, run with manage.py shell -c
+STATIC_DIRS_SCRIPT = ("from django.contrib.staticfiles import finders; from django.template import engines; "
+                      "[print('static', s.location) for f in finders.get_finders() "
+                      "for s in getattr(f, 'storages', {}).values()]; "
+                      "[print('templates', d) for e in engines.all() for d in e.template_dirs]")
+
+# digests of static files uploaded to project.static_root (project.static: local), in app_path:
+# nothing but static files is written to static_root, it is served publicly
+STATIC_UPLOAD_MANIFEST = '.static.uploaded.json'
+
+# local build dir of static files (project.static: local), next to fabric.yml, see scripts/build_static.py
+STATIC_BUILD_DIR = '.static-build'
+
+
+def upload(c):
+    """
+    Collect and compress static files locally, in a build dir next to fabric.yml, and
+    upload changed files to project.static_root. Files with the same contents as a file
+    on remote (eg. renamed, hashed files) are copied on remote instead of uploaded.
+    Files are not removed from static_root: running processes may still refer to them.
+    """
+    static_root = c.config.project.get('static_root')
+    if not static_root:
+        print(f'{RED}Set project.static_root to upload locally built static files.{COL_END}')
+        return False
+
+    env = {'PATH': '/usr/bin:/bin'}
+    fab_path = dirname(c.config._runtime_path)
+    build_path = os.path.join(fab_path, STATIC_BUILD_DIR)
+    python = c.config.project.get('local_python') or sys.executable
+    settings = c.config.project.get('static_settings') or f'{c.config.project.name}.settings'
+
+    print(f'{CYAN}Building static files locally in {build_path}...{COL_END}')
+    start = time.perf_counter()
+    c.local(f'cd {os.path.join(fab_path, c.config.project.source)} && {python} {scripts.path("build_static")}',
+            env={'DJANGO_SETTINGS_MODULE': settings, 'STATIC_BUILD_ROOT': build_path})
+
+    local = {path.split('/', 1)[1]: value
+             for path, value in _archive.local_manifest(fab_path, STATIC_BUILD_DIR, []).items()}
+    app_path = c.config.data.app_path
+    manifest_path = f'{app_path}/{STATIC_UPLOAD_MANIFEST}'
+    # earlier versions kept the manifest in static_root
+    legacy_path = f'{static_root}/{STATIC_MANIFEST}'
+    result = c.run(f'mkdir -p {static_root} && (cat {manifest_path} || cat {legacy_path})', hide=True, warn=True)
+    remote = json.loads(result.stdout) if result.ok and result.stdout.strip() else {}
+    by_digest = {digest: path for path, (digest, _) in remote.items()}
+
+    changed = [path for path, (digest, _) in local.items() if remote.get(path, [None])[0] != digest]
+    copies = [(by_digest[local[path][0]], path) for path in changed if local[path][0] in by_digest]
+    uploads = [path for path in changed if local[path][0] not in by_digest]
+    print(f'{len(uploads)} uploaded, {len(copies)} copied on remote, '
+          f'{len(local) - len(changed)} unchanged static files.')
+
+    if uploads:
+        codec, decompress = _archive.transfer_codec(c)
+        file_name = f'{c.config.project.name}.static.tar.{_archive.CODECS[codec]["ext"]}'
+        list_name = f'/tmp/{c.config.project.name}.static.list'
+        with open(list_name, 'w') as f:
+            f.write('\n'.join(uploads) + '\n')
+        try:
+            c.local(f'set -o pipefail && cd {build_path} && tar -cf - -T {list_name} '
+                    f'| {_archive.compress_command(c, codec)} > /tmp/{file_name}', env=env)
+            c.put(f'/tmp/{file_name}', f'{app_path}/{file_name}')
+            c.run(f'set -o pipefail && cd {static_root} && {decompress} < {app_path}/{file_name} | tar -xf -')
+        finally:
+            c.local(f'rm -f /tmp/{file_name} {list_name}', env=env)
+            c.run(f'rm -f {app_path}/{file_name}', warn=True)
+
+    if copies:
+        list_path = f'{app_path}/.static.copies'
+        c.put(io.StringIO(''.join(f'{source}\t{path}\n' for source, path in copies)), list_path)
+        try:
+            c.run(f'cd {static_root} && while IFS="$(printf \'\\t\')" read -r source path; do '
+                  f'mkdir -p "$(dirname "$path")" && cp -p "$source" "$path"; done < {list_path}')
+        finally:
+            c.run(f'rm -f {list_path}', warn=True)
+
+    remote.update(local)
+    c.put(io.StringIO(json.dumps(remote)), manifest_path)
+    c.run(f'rm -f {legacy_path}', hide=True)
+    print(f'{GREEN}Static files built and uploaded in {time.perf_counter() - start:.1f}s{COL_END}')
+    return True
+
+
+def files(c):
+    """
+    Hash the contents of static files and templates, in the dirs Django finds them in, see
+    STATIC_DIRS_SCRIPT. Dirs of installed packages are left out: requirements are tracked by hash.
+    Files are keyed by their dir (relative to the src dir, which may be a release) and their
+    path in that dir.
+    :return: Dict of static and templates, each a dict of path and sha256; None when unknown
+    """
+    result = virtual_env.manage(c, f'shell -c "{STATIC_DIRS_SCRIPT}"', hide=True, echo=False, warn=True)
+    if not result.ok:
+        return None
+
+    dirs = {'static': [], 'templates': []}
+    for line in result.stdout.splitlines():
+        kind, _, path = line.partition(' ')
+        if kind in dirs and '/site-packages/' not in path:
+            dirs[kind].append(path)
+
+    src_path = c.config.data.src_path
+    src_paths = [src_path, c.run(f'readlink -f {src_path}', hide=True).stdout.strip()]
+    excludes = ' '.join(f"-not -path '*/{x}/*'" for x in c.config.archive_excludes)
+    files = {}
+    for kind, paths in dirs.items():
+        files[kind] = {}
+        if not paths:
+            continue
+        # missing dirs (eg. an app without static files) are skipped
+        hashed = c.run(f'for d in {" ".join(paths)}; do [ -d "$d" ] && echo "{STATIC_DIR_MARKER} $d" '
+                       f'&& (cd "$d" && find . -type f {excludes} -exec sha256sum {{}} +); done',
+                       hide=True, warn=True)
+        key = None
+        for line in hashed.stdout.splitlines():
+            if line.startswith(f'{STATIC_DIR_MARKER} '):
+                path = line.split(' ', 1)[1]
+                key = next((os.path.relpath(path, x) for x in src_paths if path.startswith(f'{x}/')), path)
+                continue
+            digest, path = line.split(None, 1)
+            files[kind][f'{key}/{path[len("./"):]}'] = digest
+    return files
@@ -1,8 +1,59 @@
+import os
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from distutils.version import StrictVersion
+from os.path import dirname
 
+from ._batch import Batch
 from ._constants import *
 
+# defaults for wait_ready, override in config.wait
+WAIT_TIMEOUT = 60
+WAIT_INITIAL_DELAY = 0.25
+WAIT_MAX_DELAY = 5
+
+# file in a cached build with the prefix it was built with, see fetch_build
+BUILD_PREFIX = '.build-prefix'
+
+
+def wait_ready(c, resources):
+    """
+    Wait for resources in Control Panel to become ready. All resources are polled concurrently,
+    each with exponential backoff plus jitter, until ready or the overall deadline is reached.
+    Reports how long each resource took to become ready.
+
+    :param c:
+    :param resources: Dictionary of resource name and function returning its (API) info
+    :return: Dictionary of resource name and its last info, check info['ready'] for success
+    """
+    wait = c.config.get('wait') or {}
+    deadline = time.monotonic() + wait.get('timeout', WAIT_TIMEOUT)
+    initial_delay = wait.get('initial_delay', WAIT_INITIAL_DELAY)
+    max_delay = wait.get('max_delay', WAIT_MAX_DELAY)
+
+    def poll(name, fetch):
+        start = time.monotonic()
+        delay = initial_delay
+        while True:
+            response = fetch()
+            if response.get('ready'):
+                print(f'{name} ready after {time.monotonic() - start:.1f}s')
+                return response
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f'{YELLOW}{name} not ready after {time.monotonic() - start:.1f}s{COL_END}')
+                return response
+
+            # full jitter: sleep somewhere between 0 and the current delay
+            time.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, max_delay)
+
+    with ThreadPoolExecutor(max_workers=len(resources) or 1) as executor:
+        futures = {name: executor.submit(poll, name, fetch) for name, fetch in resources.items()}
+        return {name: future.result() for name, future in futures.items()}
+
 
 def find_executable(c, executable):
     """
@@ -10,6 +61,21 @@ def find_executable(c, executable):
     :return: Path or False when not found
     """
     result = c.run(f'command -v {executable}', hide=True, warn=True)
+    return _executable_path(executable, result)
+
+
+def find_executables(c, *executables):
+    """
+    Find full paths of given executable files, in one batch.
+    :return: List of paths or False when one is not found
+    """
+    with Batch(c) as batch:
+        results = [batch.run(f'command -v {x}', hide=True, warn=True) for x in executables]
+    paths = [_executable_path(x, result) for x, result in zip(executables, results)]
+    return paths if all(paths) else False
+
+
+def _executable_path(executable, result):
     if result.stderr:
         print(f'{RED}Could not find {executable}{COL_END}')
         return False
@@ -33,7 +99,10 @@ def pre_install_executable(c, executable, version):
     :return: False if installer should stop, True when it should continue installation
     """
     installed_version = None
-    result = c.run(f'{executable} --version', warn=True, hide=True)
+    with Batch(c) as batch:
+        result = batch.run(f'{executable} --version', warn=True, hide=True)
+        # create build dirs
+        batch.run('mkdir -p ~/{bin,opt,src,tmp,etc}')
     if result.stdout:
         _, result_version = result.stdout.strip().split(' ')
         installed_version = StrictVersion(result_version)
@@ -43,9 +112,6 @@ def pre_install_executable(c, executable, version):
             print(f'{GREEN}{executable} ({version}) install found: {installed_version}{COL_END}')
             return False
 
-    # create build dirs
-    c.run('mkdir -p ~/{bin,opt,src,tmp,etc}')
-
     if installed_version:
         print(f'Server has python version {installed_version}. ')
 
@@ -72,45 +138,128 @@ def download_executable(c, file_name, url):
     return True
 
 
-def get_app_id(c, app_name):
+def build_jobs(c):
     """
-    Retrieve app-id for a given app name (in full). Called from get_id, not for use as sub-task.
-    :return: False on error, True on not found (continue), or string with app uuid
+    Number of parallel make jobs, as configured in build.jobs (0: all cores on remote).
     """
-    print(f'{CYAN}Retrieving app-id for {app_name}...{COL_END}')
-    response = c.config.control.api.get_apps()
+    jobs = int((c.config.get('build') or {}).get('jobs') or 0)
+    if jobs <= 0:
+        jobs = int(c.run('nproc', hide=True, warn=True).stdout.strip() or 1)
+    return jobs
 
-    try:
-        rec = next(x for x in response if x['name'] == app_name)
-    except StopIteration:
-        print(f'{YELLOW}No app-id found: app does not exist.{COL_END}')
-        # this is a valid response:
-        return True
 
-    return rec['id']
+def build_key(c, name):
+    """
+    Key of a build in the build cache: name (eg. python-3.9.0) plus os and arch of remote.
+    """
+    result = c.run('. /etc/os-release 2>/dev/null; echo ${ID:-linux}${VERSION_ID}-$(uname -m)', hide=True)
+    return f'{name}-{result.stdout.strip()}'
+
+
+def _build_cache_path(c):
+    build = c.config.get('build') or {}
+    if not build.get('cache', True):
+        return None
+    path = build.get('cache_path') or os.path.join(dirname(c.config._runtime_path or '') or '.', '.build-cache')
+    return os.path.expanduser(path)
+
+
+def fetch_build(c, key, dir_name, relocate=True):
+    """
+    Unpack a cached build into ~/opt/dir_name. Builds are cached locally, so they can be
+    reused for other users (or servers with the same os and arch).
+    :param relocate: Relocate the build from the prefix it was built with (see BUILD_PREFIX)
+        to its new one, False for builds not referring to their prefix (eg. redis)
+    :return: True when unpacked, False when not cached (or caching is disabled)
+    """
+    cache_path = _build_cache_path(c)
+    if not cache_path or not os.path.exists(os.path.join(cache_path, f'{key}.tar.gz')):
+        return False
+
+    print(f'{CYAN}Installing cached build {key} to ~/opt/{dir_name}...{COL_END}')
+    c.run('mkdir -p ~/opt ~/tmp')
+    c.put(os.path.join(cache_path, f'{key}.tar.gz'), f'tmp/{key}.tar.gz')
+    c.run(f'tar -xzf ~/tmp/{key}.tar.gz -C ~/opt && rm ~/tmp/{key}.tar.gz')
+    return _relocate_build(c, key, dir_name) if relocate else True
+
+
+def _relocate_build(c, key, dir_name):
+    """
+    Rewrite the prefix a build was made with in its text files referring to it: scripts in bin
+    (shebangs, python3-config), sysconfig data and Makefile of python, pkg-config files.
+    :return: True when relocated, False when the prefix is unknown (the build is removed)
+    """
+    path = f'~/opt/{dir_name}'
+    result = c.run(f'cat {path}/{BUILD_PREFIX}', hide=True, warn=True)
+    if not result.ok or not result.stdout.strip():
+        print(f'{YELLOW}Prefix of cached build {key} unknown, building instead.{COL_END}')
+        c.run(f'rm -rf {path}')
+        return False
+
+    old_prefix = result.stdout.strip()
+    files = ' '.join(f'{path}/{x}' for x in ['bin', 'lib/pkgconfig', 'lib/python*/_sysconfigdata*.py',
+                                               'lib/python*/config-*/Makefile'])
+    c.run(f'new_prefix="$HOME/opt/{dir_name}" && if [ "{old_prefix}" != "$new_prefix" ]; then '
+          f'grep -rlIZF "{old_prefix}" {files} 2>/dev/null | xargs -0 -r sed -i "s|{old_prefix}|$new_prefix|g" '
+          f'&& rm -f {path}/lib/python*/__pycache__/_sysconfigdata* '
+          f'&& echo "$new_prefix" > {path}/{BUILD_PREFIX}; fi')
+    return True
+
+
+def store_build(c, key, dir_name):
+    """
+    Store a build in ~/opt/dir_name in the build cache.
+    """
+    cache_path = _build_cache_path(c)
+    if not cache_path:
+        return
+
+    print(f'{CYAN}Storing build {key} in {cache_path}...{COL_END}')
+    os.makedirs(cache_path, exist_ok=True)
+    c.run(f'echo "$HOME/opt/{dir_name}" > ~/opt/{dir_name}/{BUILD_PREFIX} '
+          f'&& tar -czf ~/tmp/{key}.tar.gz -C ~/opt {dir_name}')
+    c.get(f'tmp/{key}.tar.gz', os.path.join(cache_path, f'{key}.tar.gz.tmp'))
+    os.replace(os.path.join(cache_path, f'{key}.tar.gz.tmp'), os.path.join(cache_path, f'{key}.tar.gz'))
+    c.run(f'rm ~/tmp/{key}.tar.gz')
 
 
-def create_app(c, app_name, app_id=None):
+def create_apps(c, apps):
     """
-    Create proxy app in Control Panel. This will also create the project.app_path on the server.
-    Requires user_id. Receives app-id on creation, which is returned.
+    Create proxy apps in Control Panel in a single request. Apps that already have an id are skipped.
+    Requires user_id. Ids of created apps are added to config.
+    :param apps: List of (config.data key, app name) tuples
+    :return: False on error, True on success
     """
-    if app_id:
-        print(f'App {app_name} exists, skipping create.')
-        return app_id
+    missing = []
+    for key, app_name in apps:
+        if c.config.data.get(key):
+            print(f'App {app_name} exists, skipping create.')
+        else:
+            missing.append((key, app_name))
+
+    if not missing:
+        return True
 
-    app_type = 'CUS'
     user_id = c.config.data.get('user_id')
     if not user_id:
         print(f'{RED}user-id is required to create an app.{COL_END}')
         return False
 
-    print(f'{CYAN}Creating app {app_name}...{COL_END}')
-    response = c.config.control.api.add_app(app_type, app_name, user_id)
+    names = ', '.join(app_name for _, app_name in missing)
+    print(f'{CYAN}Creating apps {names}...{COL_END}')
+    payload = [{'type': 'CUS', 'name': app_name, 'osuser': user_id} for _, app_name in missing]
+    response = c.config.control.api.add_apps(payload)
     # response is a list
 
-    print(f'{GREEN}App {app_name} created!{COL_END}')
-    return response[0]['id']
+    ids = {rec['name']: rec['id'] for rec in response}
+    for key, app_name in missing:
+        if app_name not in ids:
+            print(f'{RED}App {app_name} was not created: check control panel!{COL_END}')
+            return False
+        c.config.data[key] = ids[app_name]
+
+    print(f'{GREEN}Apps {names} created!{COL_END}')
+    return True
 
 
 def get_app_info(c, app_id):
@@ -123,17 +272,18 @@ def get_app_info(c, app_id):
 
     print(f'{CYAN}Retrieving app info for id {app_id}...{COL_END}')
 
-    response = None
-    attempts = 5
-    while attempts > 0:
-        response = c.config.control.api.get_app_info(app_id)
-        if response.get('ready'):
-            break
+    api = c.config.control.api
+    response = wait_ready(c, {f'App {app_id}': lambda: api.get_app_info(app_id)})[f'App {app_id}']
+    if not check_app_info(response):
+        return False
+    return response
 
-        print(f'Waiting 5 seconds for app to be created...')
-        time.sleep(5)
-        attempts -= 1
 
+def check_app_info(response):
+    """
+    Verify app-info is of a ready, custom app.
+    :return: False on error, True when app is ok
+    """
     app_name = response['name']
     if not response.get('ready'):
         print(f'{RED}App {app_name} is not installed ok: check control panel!{COL_END}')
@@ -146,4 +296,4 @@ def get_app_info(c, app_id):
 
     msg = 'Found app {name} for user {osuser} at port {port}.'.format(**response)
     print(f'{GREEN}{msg}{COL_END}')
-    return response
+    return True
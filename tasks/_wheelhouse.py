@@ -0,0 +1,78 @@
+"""
+Wheelhouse (project.wheelhouse): requirements are installed on remote from wheels collected
+locally for the remote python and platform, so the server needs no package index or compilers.
+"""
+import os
+import platform
+import re
+import sys
+import sysconfig
+import time
+from os.path import dirname
+
+from ._constants import *
+
+# prints python version (eg. 39), machine, glibc version and platform (eg. linux-x86_64) of the remote env
+WHEEL_TARGET_SCRIPT = ("import platform, sys, sysconfig; "
+                       "print('%d%d' % sys.version_info[:2], platform.machine(), platform.libc_ver()[1] or '0', "
+                       "sysconfig.get_platform())")
+
+
+def ship(c):
+    """
+    Collect wheels of the local requirements for the python version and platform of the
+    remote env in a local cache (project.wheel_cache) and upload the wheels missing in the
+    remote wheelhouse. Wheels are downloaded as binaries for the remote platform, or built
+    locally when not available as binary and the local python version and platform match
+    (same platform tag and a glibc not newer than the remote one).
+    :return: pip options installing from the remote wheelhouse only, None on error
+    """
+    fab_path = dirname(c.config._runtime_path)
+    requirements = os.path.join(fab_path, c.config.project.source, 'requirements.txt')
+    result = c.run(f'{c.config.data.env_path}/bin/python -c "{WHEEL_TARGET_SCRIPT}"', hide=True)
+    version, arch, glibc, target_platform = result.stdout.split()
+    cache_path = os.path.join(c.config.project.get('wheel_cache') or os.path.join(fab_path, '.wheelhouse'),
+                              f'cp{version}-{arch}')
+    os.makedirs(cache_path, exist_ok=True)
+
+    print(f'{CYAN}Collecting wheels for cp{version} {arch} in {cache_path}...{COL_END}')
+    start = time.perf_counter()
+    glibc_minor = int(glibc.split('.')[1]) if glibc.startswith('2.') else 0
+    platforms = [f'manylinux_2_{x}_{arch}' for x in range(glibc_minor, 4, -1)]
+    platforms += [f'{x}_{arch}' for x, minor in [('manylinux2014', 17), ('manylinux2010', 12), ('manylinux1', 5)]
+                  if glibc_minor >= minor] + [f'linux_{arch}']
+    platform_args = ' '.join(f'--platform {x}' for x in platforms)
+    # before python 3.8, the abi of cpython has an m (pymalloc) suffix, eg. cp36m
+    abis = [f'cp{version}m'] if int(version[1:]) < 8 and version[0] == '3' else [f'cp{version}']
+    abi_args = ' '.join(f'--abi {x}' for x in abis + ['abi3', 'none'])
+    # the local PATH: run.env holds the remote one, building sdists needs compilers
+    env = {'PATH': os.environ.get('PATH') or '/usr/bin:/bin'}
+    result = c.local(f'{sys.executable} -m pip download -q -r {requirements} -d {cache_path} '
+                     f'--only-binary=:all: --implementation cp --python-version {version} '
+                     f'{abi_args} {platform_args}', env=env, warn=True)
+    if not result.ok:
+        if f'{sys.version_info[0]}{sys.version_info[1]}' != version:
+            print(f'{RED}Not all requirements are available as wheels for cp{version} {arch}, '
+                  f'run fab with python {version[0]}.{version[1:]} to build them locally.{COL_END}')
+            return None
+        local_glibc = platform.libc_ver()[1] or '0'
+        if sysconfig.get_platform() != target_platform or _version_tuple(local_glibc) > _version_tuple(glibc):
+            print(f'{RED}Not all requirements are available as wheels for cp{version} {target_platform} '
+                  f'(glibc {glibc}), can\'t build them on {sysconfig.get_platform()} (glibc {local_glibc}).{COL_END}')
+            return None
+        print(f'{YELLOW}Not all requirements are available as wheels, building locally...{COL_END}')
+        c.local(f'{sys.executable} -m pip wheel -q -r {requirements} -w {cache_path}', env=env)
+
+    wheelhouse = f'{c.config.data.app_path}/wheelhouse'
+    result = c.run(f'mkdir -p {wheelhouse} && ls {wheelhouse}', hide=True)
+    shipped = set(result.stdout.split())
+    missing = [x for x in sorted(os.listdir(cache_path)) if x not in shipped]
+    for name in missing:
+        c.put(os.path.join(cache_path, name), f'{wheelhouse}/{name}')
+    print(f'{GREEN}Uploaded {len(missing)} of {len(missing) + len(shipped & set(os.listdir(cache_path)))} '
+          f'wheels in {time.perf_counter() - start:.1f}s{COL_END}')
+    return f'--no-index --find-links {wheelhouse} '
+
+
+def _version_tuple(version):
+    return tuple(int(x) for x in re.findall(r'\d+', version))
@@ -1,40 +1,37 @@
-from ._util import get_app_id, create_app, get_app_info
+from ._util import create_apps, get_app_info
+from ._scheduler import declare
 from ._constants import *
 
 
-def get_id(c):
+@declare(needs=['api', 'connection', 'user_id', 'app_id', 'redis_app_id', 'supervisor_app_id'],
+         provides=['app_id', 'redis_app_id', 'supervisor_app_id'])
+def create_all(c):
     """
-    Find app-id by project name. Add id to config.
+    Create main project app, redis app and supervisor app (when configured) in one request.
+    Add ids to config.
     """
-    app_name = c.config.project.name
-    app_id = get_app_id(c, app_name)
-    if not isinstance(app_id, str):
-        return app_id
+    apps = [('app_id', c.config.project.name)]
+    if c.config.project.dependencies.get('redis'):
+        apps.append(('redis_app_id', f'{c.config.project.name}_redis'))
+    if c.config.project.get('supervisor'):
+        apps.append(('supervisor_app_id', f'{c.config.project.user}_supervisor'))
 
-    c.config.data.app_id = app_id
-    print(f'{GREEN}Found app-id: {c.config.data.app_id} for {app_name}{COL_END}')
-    return True
-
-
-def create(c):
-    """
-    Create main project app by name. Add id to config.
-    """
-    app_name = c.config.project.name
-    app_id = c.config.data.get('app_id')
-    c.config.data.app_id = create_app(c, app_name, app_id)
+    if not create_apps(c, apps):
+        return False
 
     # create tmp dir
     c.run(f'mkdir -p /home/{c.config.project.user}/apps/{c.config.project.name}/tmp')
     return True
 
 
+@declare(needs=['api', 'app_id', 'app_info'],
+         provides=['app_info', 'app_path', 'log_path', 'src_path', 'env_path', 'backup_path'])
 def get_info(c):
     """
     Find main project app-info by app-id. Add info + project paths to config.
     """
     app_id = c.config.data.get('app_id')
-    if app_id:
+    if app_id and not c.config.data.get('app_info'):
         c.config.data.app_info = get_app_info(c, app_id)
 
     c.config.data.app_path = f'/home/{c.config.project.user}/apps/{c.config.project.name}'.lower()
@@ -1,8 +1,15 @@
+import asyncio
+import time
 from importlib import import_module
 
+from ._util import check_app_info
+from ._scheduler import declare
 from ._constants import *
 
+DEFAULT_CONCURRENCY = 6
 
+
+@declare(provides=['api'], always=True)
 def login(c):
     """
     Login to Control Panel API, as defined in config.control.service.
@@ -21,11 +28,137 @@ def login(c):
     else:
         print(f'{CYAN}Performing login with provided username and password...{COL_END}')
 
+    # optional connection settings, service defaults apply when not configured
+    options = {}
+    for key in ['pool_size', 'retries', 'backoff', 'timeout', 'cache_ttls']:
+        value = c.config.control.get(key)
+        if value is not None:
+            if isinstance(value, list):
+                value = tuple(value)
+            elif isinstance(value, dict) or hasattr(value, '_config'):
+                value = dict(value)
+            options[key] = value
+
     try:
-        api = service.API(token=token, username=username, password=password)
+        api = service.API(token=token, username=username, password=password, **options)
     except service.ApiException as e:
         print(f'{RED}{e}{COL_END}')
         return False
 
     c.config.control.api = api
     return True
+
+
+@declare(needs=['api'],
+         provides=['server_id', 'user_id', 'user_info', 'app_id', 'app_info', 'redis_app_id', 'redis_app_info',
+                   'supervisor_app_id', 'db_id'])
+def discover(c):
+    """
+    Resolve ids of server, user, apps and database, and info of user and apps,
+    concurrently. Add them to config, like the get_info tasks do.
+    Requires a service with an AsyncAPI. Concurrency is capped by config.control.concurrency.
+    """
+    db_type = c.config.project.get('database')
+    if db_type and db_type.lower() not in ('none', 'sqlite', 'postgres', 'mariadb'):
+        print(f'{RED}Unknown database type: {db_type}.{COL_END}')
+        return False
+
+    service = import_module(c.config.control.service)
+    concurrency = c.config.control.get('concurrency') or DEFAULT_CONCURRENCY
+    api = service.AsyncAPI(c.config.control.api, concurrency=concurrency)
+
+    print(f'{CYAN}Discovering ids and info (concurrency: {concurrency})...{COL_END}')
+    start = time.perf_counter()
+    try:
+        found = asyncio.run(_discover(c, api))
+    except service.ApiException as e:
+        print(f'{RED}{e}{COL_END}')
+        return False
+    finally:
+        api.close()
+
+    for key, value in found.items():
+        c.config.data[key] = value
+
+    print(f'{GREEN}Discovered {", ".join(sorted(found)) or "nothing"} '
+          f'in {time.perf_counter() - start:.2f}s{COL_END}')
+    return True
+
+
+async def _discover(c, api):
+    """
+    Gather all lookups, each followed by its info lookup.
+    :return: Dictionary with keys and values to add to config.data
+    """
+    project = c.config.project
+    dependencies = project.get('dependencies') or {}
+    db_type = (project.get('database') or '').lower()
+
+    lookups = [
+        ('server_id', None, api.find_server(project.server)),
+    ]
+    if project.get('user'):
+        lookups.append(('user_id', 'user_info', api.find_user(project.user)))
+    lookups.append(('app_id', 'app_info', api.find_app(project.name)))
+    if dependencies.get('redis'):
+        lookups.append(('redis_app_id', 'redis_app_info', api.find_app(f'{project.name}_redis')))
+    if project.get('supervisor'):
+        lookups.append(('supervisor_app_id', None, api.find_app(f'{project.user}_supervisor')))
+    if db_type == 'postgres':
+        lookups.append(('db_id', None, api.find_psql(project.name)))
+    elif db_type == 'mariadb':
+        lookups.append(('db_id', None, api.find_mariadb(project.name)))
+
+    results = await asyncio.gather(*[_lookup(api, *x) for x in lookups])
+
+    found = {}
+    for result in results:
+        found.update(result)
+    return found
+
+
+async def _lookup(api, id_key, info_key, find):
+    """
+    Await a find, then the info of the found record, if ready.
+    """
+    rec = await find
+    if not rec:
+        print(f'{YELLOW}No {id_key} found.{COL_END}')
+        return {}
+
+    found = {id_key: rec['id']}
+    print(f'{GREEN}Found {id_key}: {rec["id"]} for {rec.get("name") or rec.get("hostname")}{COL_END}')
+    if not info_key:
+        return found
+
+    if info_key == 'user_info':
+        info = await api.get_user_info(rec['id'])
+        if info.get('ready'):
+            found[info_key] = info
+    else:
+        info = await api.get_app_info(rec['id'])
+        if info.get('ready') and check_app_info(info):
+            found[info_key] = info
+    return found
+
+
+def report(c):
+    """
+    Print the latency of each API call made during this run.
+    """
+    api = c.config.control.get('api')
+    if not api:
+        return True
+
+    latencies = getattr(api, 'latencies', [])
+    if not latencies:
+        return True
+
+    print(f'{CYAN}API calls:{COL_END}')
+    for method, method_name, seconds in latencies:
+        print(f'  {method:<6} {method_name:<50} {seconds * 1000:8.1f} ms')
+
+    total = sum(x[2] for x in latencies)
+    print(f'{GREEN}{len(latencies)} API calls in {total:.2f}s '
+          f'(avg {total / len(latencies) * 1000:.1f} ms){COL_END}')
+    return True
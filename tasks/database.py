@@ -1,48 +1,9 @@
-import time
-
+from ._util import wait_ready
+from ._scheduler import declare
 from ._constants import *
 
 
-def get_id(c):
-    """
-    Retrieve id of configured database. Store in config.
-    """
-    db_type = c.config.project.get('database')
-    if not db_type or db_type.lower() == 'none' or db_type.lower() == 'sqlite':
-        # nothing to do
-        return True
-
-    db_name = c.config.project.name
-    print(f'{CYAN}Retrieving db-id for {db_name}...{COL_END}')
-
-    if db_type == 'postgres':
-        key = 'psqldbs'
-        response = c.config.control.api.get_psqls()
-
-    elif db_type == 'mariadb':
-        key = 'mariadbs'
-        response = c.config.control.api.get_mariadbs()
-
-    else:
-        print(f'{RED}Unknown database type: {db_type}.{COL_END}')
-        return False
-
-    try:
-        rec = next(x for x in response[key] if x['name'] == db_name)
-    except StopIteration:
-        print(f'{YELLOW}No db-id found: {db_type} db {db_name} does not exist.{COL_END}')
-        # this is a valid response:
-        return True
-
-    db_id = rec['id']
-    if not isinstance(db_id, str):
-        return db_id
-
-    c.config.data.db_id = db_id
-    print(f'{GREEN}Found db-id: {c.config.data.db_id} for {db_name}{COL_END}')
-    return True
-
-
+@declare(needs=['api', 'server_id', 'db_id'], provides=['db_id', 'db_info', 'db'])
 def create(c):
     """
     Create database in control panel. DB user of same name will be created automatically.
@@ -82,43 +43,24 @@ def create(c):
     db_user_id = response.get('dbuserid')
     c.config.data.db_info = response
 
-    # wait for db to be created
-    response = None
-    attempts = 5
-    while attempts > 0:
-        if db_type == 'postgres':
-            response = c.config.control.api.get_psql_info(db_id)
-        else:
-            response = c.config.control.api.get_mariadb_info(db_id)
-
-        if response.get('ready'):
-            break
+    # wait for db and db-user to be created
+    api = c.config.control.api
+    if db_type == 'postgres':
+        get_db_info, get_user_info = api.get_psql_info, api.get_psql_userinfo
+    else:
+        get_db_info, get_user_info = api.get_mariadb_info, api.get_mariadb_userinfo
 
-        print(f'Waiting 5 seconds for db to be created...')
-        time.sleep(5)
-        attempts -= 1
+    db_key, user_key = f'Database {db_name}', f'Database user {db_user_name}'
+    responses = wait_ready(c, {
+        db_key: lambda: get_db_info(db_id),
+        user_key: lambda: get_user_info(db_user_id),
+    })
 
-    if not response.get('ready'):
+    if not responses[db_key].get('ready'):
         print(f'{RED}{db_type} database {db_name} is not installed ok: check control panel!{COL_END}')
         return False
 
-    # wait for db-user to be created
-    response = None
-    attempts = 5
-    while attempts > 0:
-        if db_type == 'postgres':
-            response = c.config.control.api.get_psql_userinfo(db_user_id)
-        else:
-            response = c.config.control.api.get_mariadb_userinfo(db_user_id)
-
-        if response.get('ready'):
-            break
-
-        print(f'Waiting 5 seconds for db user to be created...')
-        time.sleep(5)
-        attempts -= 1
-
-    if not response.get('ready'):
+    if not responses[user_key].get('ready'):
         print(f'{RED}database user {db_user_name} is not installed ok: check control panel!{COL_END}')
         return False
 
@@ -1,98 +1,433 @@
+import hashlib
+import io
+import json
+import os
+import re
+import time
 from os.path import dirname
 
-from . import virtual_env
+from . import _archive, _releases, _snapshots, _static, _wheelhouse, virtual_env
+from ._batch import Batch
+from ._scheduler import declare
 from ._constants import *
 
 # TODO: also backup/restore static files?
 
-
+DEFAULT_DB_JOBS = 4
+DEFAULT_KEEP_ENVS = 3
+
+# migration files in the src dir after the last migrate, in app_path
+MIGRATIONS_STATE = '.migrations.json'
+
+# stored in the virtual env: hash of the installed requirements and python version
+REQUIREMENTS_STATE = '.requirements.json'
+
+# dumps of the database schema, when there are no migrations to backup for
+DB_SCHEMA_DUMPS = {
+    'postgres': 'pg_dump -U {user} -s {db} > {path}',
+    'mariadb': 'mysqldump --no-data --routines {db} > {path}',
+}
+
+# database dump formats, directory formats dump and restore tables in parallel
+DB_FORMATS = {
+    'pg_custom': {
+        'db': 'postgres', 'ext': 'db',
+        'dump': 'pg_dump -U {user} -Fc {db} > {path}',
+        'restore': 'pg_restore -U {user} -c --if-exists -d {db} {path}',
+    },
+    'pg_directory': {
+        'db': 'postgres', 'ext': 'dir',
+        'dump': 'pg_dump -U {user} -Fd -j {jobs} -f {path} {db}',
+        'restore': 'pg_restore -U {user} -c --if-exists -j {jobs} -d {db} {path}',
+    },
+    # mariadb credentials are read from ~/.my.cnf
+    'mysqldump': {
+        'db': 'mariadb', 'ext': 'sql.gz',
+        'dump': 'set -o pipefail && mysqldump --single-transaction --routines {db} | gzip > {path}',
+        'restore': 'set -o pipefail && gzip -dc {path} | mysql {db}',
+    },
+    'mydumper': {
+        'db': 'mariadb', 'ext': 'mydumper',
+        'dump': 'mydumper --database {db} --threads {jobs} --trx-consistency-only --compress --outputdir {path}',
+        'restore': 'myloader --database {db} --threads {jobs} --overwrite-tables --directory {path}',
+    },
+}
+
+
+@declare(needs=['connection', 'src_path', 'backup_path'], provides=['db_backup'])
 def backup_db(c):
     """
-    Create a backup of the remote db.
+    Create a backup of the remote db, in parallel with project.db_jobs > 1:
+        postgres: pg_dump directory format with -j jobs
+        mariadb: mydumper with as many threads if installed, else mysqldump
+    The previous backup is kept as one of project.keep_db_backups older backups.
+    With project.db_backup: migrations, the db is only dumped when the local code (to be uploaded)
+    has unapplied migrations, else only its schema is dumped and a rollback leaves the db as is.
     """
     db_type = c.config.project.get('database')
     if not db_type or db_type.lower() == 'none' or db_type.lower() == 'sqlite':
         # nothing to do
         return True
 
-    print(f'{CYAN}Creating backup of remote database...{COL_END}')
-
     # create backup dir
     c.run(f'mkdir -p {c.config.data.backup_path}')
+    base_name = f'{c.config.data.backup_path}/{c.config.project.name}'
+    state = _db_backup_state(c, base_name)
+
+    if c.config.project.get('db_backup', 'always') == 'migrations':
+        start = time.perf_counter()
+        pending = _pending_migrations(c)
+        if pending == 0:
+            print(f'{CYAN}No pending migrations, dumping database schema only...{COL_END}')
+            c.run(DB_SCHEMA_DUMPS[db_type.lower()].format(
+                user=c.config.project.user, db=c.config.project.name, path=f'{base_name}.schema.sql'), echo=True)
+            seconds = time.perf_counter() - start
+            saved = max(state.get('seconds', 0) - seconds, 0)
+            _write_db_backup_state(c, base_name, dict(state, restore=False))
+            print(f'{GREEN}Skipped database backup in {seconds:.1f}s, '
+                  f'saved about {saved:.1f}s (last full backup){COL_END}')
+            return True
+        if pending:
+            print(f'{pending} pending migrations, full backup needed.')
+        else:
+            print(f'{YELLOW}Could not check pending migrations, full backup needed.{COL_END}')
+
+    print(f'{CYAN}Creating backup of remote database...{COL_END}')
 
-    file_name = f'{c.config.data.backup_path}/{c.config.project.name}.last.db'
-    c.run(f'pg_dump -U {c.config.project.user} -Fc {c.config.project.name} > {file_name}', echo=True)
+    jobs = _db_jobs(c)
+    fmt = _pick_db_format(c, db_type.lower(), jobs)
+    file_name = f'{base_name}.last.{DB_FORMATS[fmt]["ext"]}'
+    start = time.perf_counter()
+    # dump aside, the last backup is only replaced by a complete one
+    c.run(f'rm -rf {file_name}.tmp', hide=True)
+    c.run(DB_FORMATS[fmt]['dump'].format(user=c.config.project.user, db=c.config.project.name,
+                                         jobs=jobs, path=f'{file_name}.tmp'), echo=True)
+    _rotate_db_backups(c, base_name, db_type.lower())
+    c.run(f'mv {file_name}.tmp {file_name}')
+    seconds = time.perf_counter() - start
+    _write_db_backup_state(c, base_name, {'format': fmt, 'seconds': round(seconds, 1), 'restore': True})
+    print(f'{GREEN}Database backup ({fmt}, {jobs} jobs) in {seconds:.1f}s{COL_END}')
     return True
 
 
+@declare(needs=['connection', 'backup_path'], provides=['db'])
 def restore_db(c):
     """
-    Restore last version of remote db.
+    Restore last version of remote db, in the format it was dumped in.
     """
     db_type = c.config.project.get('database')
     if not db_type or db_type.lower() == 'none' or db_type.lower() == 'sqlite':
         # nothing to do
         return True
 
-    file_name = f'{c.config.data.backup_path}/{c.config.project.name}.last.db'
-    result = c.run(f'stat {file_name}', hide=True)
-    if not result.ok:
-        print(f'{RED}Could not find database backup: {file_name}{COL_END}')
+    base_name = f'{c.config.data.backup_path}/{c.config.project.name}'
+    if not _db_backup_state(c, base_name).get('restore', True):
+        print(f'{BLUE}Database was not migrated by the last deploy, skipping restore.{COL_END}')
+        return True
+
+    formats = {f'{base_name}.last.{x["ext"]}': fmt for fmt, x in DB_FORMATS.items() if x['db'] == db_type.lower()}
+    result = c.run(f'ls -dt {" ".join(formats)}', hide=True, warn=True)
+    if not result.stdout.strip():
+        print(f'{RED}Could not find database backup: {base_name}.last.*{COL_END}')
         return False
 
-    c.run(f'pg_restore -U {c.config.project.user} -c --if-exists -d {c.config.project.name} {file_name}', echo=True)
+    file_name = result.stdout.split()[0]
+    fmt = formats[file_name]
+    # migrations applied after the backup are undone: let Django plan the next migrate
+    c.run(f'rm -f {c.config.data.app_path}/{MIGRATIONS_STATE}')
+    c.run(DB_FORMATS[fmt]['restore'].format(user=c.config.project.user, db=c.config.project.name,
+                                            jobs=_db_jobs(c), path=file_name), echo=True)
     return True
 
 
+def _pending_migrations(c):
+    """
+    Count migrations of the local code not yet applied to the db, before it is uploaded: the
+    migration files in the local source that were not there after the last migrate, see
+    _plan_migrations. Unknown without a state, or when requirements changed or will change.
+    :return: Number of pending migrations, None when unknown
+    """
+    state = _migrations_state(c)
+    if not state or state.get('requirements') != _requirements_state(c, c.config.data.env_path).get('hash'):
+        return None
+
+    source = os.path.join(dirname(c.config._runtime_path), c.config.project.source)
+    local = _read_requirements(c, os.path.join(source, 'requirements.txt'), local=True)
+    remote = _read_requirements(c, f'{c.config.data.src_path}/requirements.txt')
+    if sorted(local.values()) != sorted(remote.values()):
+        return None
+
+    return len([x for x in _local_migration_files(source, c.config.archive_excludes)
+                if x not in state['migrations']])
+
+
+def _plan_migrations(c):
+    """
+    Plan migrations without starting Django: pending migrations are the migration files in the
+    src dir that were not there after the last migrate, see MIGRATIONS_STATE. Without a state, or
+    when requirements changed (installed apps have migrations too), Django is asked instead.
+    :return: List of pending migrations (app.name), None when unknown
+    """
+    state = _migrations_state(c)
+    if state and state.get('requirements') == _requirements_state(c, c.config.data.env_path).get('hash'):
+        return [x for x in _migration_files(c) if x not in state['migrations']]
+
+    result = virtual_env.manage(c, 'showmigrations --plan', hide=True, echo=False, warn=True)
+    if not result.ok:
+        return None
+    return [line[4:].strip() for line in result.stdout.splitlines() if line.startswith('[ ]')]
+
+
+def _migration_files(c):
+    """
+    Migrations in the remote src dir, as app.name (app being the dir name of the app).
+    """
+    excludes = ' '.join(f"-not -path '*/{x}/*'" for x in c.config.archive_excludes)
+    result = c.run(f"cd {c.config.data.src_path} && find . -path '*/migrations/*.py' -not -name '__init__.py' "
+                   f"{excludes} -printf '%P\\n'", hide=True, warn=True)
+    migrations = []
+    for path in result.stdout.splitlines():
+        parts = path[:-len('.py')].split('/')
+        migrations.append(f'{parts[-3] if len(parts) > 2 else ""}.{parts[-1]}')
+    return sorted(migrations)
+
+
+def _local_migration_files(source, excludes):
+    """
+    Migrations in the local source dir, as app.name like _migration_files.
+    """
+    migrations = []
+    for root, dirs, files in os.walk(source):
+        rel_root = os.path.relpath(root, source)
+        dirs[:] = [d for d in dirs if not _archive.excluded(f'{rel_root}/{d}', excludes)]
+        if 'migrations' not in rel_root.split(os.sep):
+            continue
+        for name in files:
+            if name.endswith('.py') and name != '__init__.py' and not _archive.excluded(f'{rel_root}/{name}', excludes):
+                parts = os.path.normpath(os.path.join(rel_root, name[:-len('.py')])).split(os.sep)
+                migrations.append(f'{parts[-3] if len(parts) > 2 else ""}.{parts[-1]}')
+    return sorted(migrations)
+
+
+def _record_migrations(c):
+    """
+    Record the migrations in the src dir as applied, see _plan_migrations.
+    """
+    state = {
+        'requirements': _requirements_state(c, c.config.data.env_path).get('hash'),
+        'migrations': _migration_files(c),
+    }
+    c.put(io.StringIO(json.dumps(state, indent=4)), f'{c.config.data.app_path}/{MIGRATIONS_STATE}')
+
+
+def _migrations_state(c):
+    result = c.run(f'cat {c.config.data.app_path}/{MIGRATIONS_STATE}', hide=True, warn=True)
+    return json.loads(result.stdout) if result.ok and result.stdout.strip() else {}
+
+
+def _db_backup_state(c, base_name):
+    """
+    State of the last db backup: format, duration in seconds and whether a rollback should restore it.
+    """
+    result = c.run(f'cat {base_name}.db.json', hide=True, warn=True)
+    return json.loads(result.stdout) if result.ok and result.stdout.strip() else {}
+
+
+def _write_db_backup_state(c, base_name, state):
+    c.put(io.StringIO(json.dumps(state)), f'{base_name}.db.json')
+
+
+def _db_jobs(c):
+    jobs = int(c.config.project.get('db_jobs') or DEFAULT_DB_JOBS)
+    if jobs <= 0:
+        # all cores on remote
+        jobs = int(c.run('nproc', hide=True).stdout.strip() or 1)
+    return jobs
+
+
+def _pick_db_format(c, db_type, jobs):
+    """
+    Pick dump format of DB_FORMATS for db type and number of jobs.
+    """
+    if db_type == 'mariadb':
+        if jobs > 1 and c.run('command -v mydumper myloader', hide=True, warn=True).stdout.count('\n') == 2:
+            return 'mydumper'
+        return 'mysqldump'
+    return 'pg_directory' if jobs > 1 else 'pg_custom'
+
+
+def _rotate_db_backups(c, base_name, db_type):
+    """
+    Move last backups (of all formats) aside as dated backups and remove dated backups
+    beyond project.keep_db_backups. Without keep_db_backups, last backups are removed.
+    """
+    keep = int(c.config.project.get('keep_db_backups') or 0)
+    with Batch(c) as batch:
+        for ext in {x['ext'] for x in DB_FORMATS.values() if x['db'] == db_type}:
+            last = f'{base_name}.last.{ext}'
+            if not keep:
+                batch.run(f'rm -rf {last}', hide=True)
+                continue
+            batch.run(f'if [ -e {last} ]; then mv {last} {base_name}.$(date -r {last} +%Y%m%d%H%M%S).{ext}; fi',
+                      hide=True)
+            # dated names sort by time
+            batch.run(f'ls -d {base_name}.2*.{ext} 2>/dev/null | sort -r | tail -n +{keep + 1} | xargs -r rm -rf',
+                      hide=True, warn=True)
+
+
+@declare(needs=['connection', 'requirements', 'db', 'db_backup'], provides=['migrations'])
 def migrate_db(c):
     """
-    Migrate database changes.
+    Migrate database changes. Skipped, without starting Django, when no migrations are pending,
+    see _plan_migrations. Reports the time taken by each migration.
     """
     db_type = c.config.project.get('database')
     if not db_type or db_type.lower() == 'none':
         # nothing to do
         return True
 
-    print(f'{CYAN}Migrating database...{COL_END}')
-    virtual_env.manage(c, 'migrate --noinput')
+    pending = _plan_migrations(c)
+    if pending == []:
+        print(f'{BLUE}No pending migrations, skipping migrate.{COL_END}')
+        _record_migrations(c)
+        return True
+
+    if pending:
+        apps = {}
+        for migration in pending:
+            apps.setdefault(migration.split('.')[0], []).append(migration.split('.', 1)[1])
+        print(f'{CYAN}Migrating database: {len(pending)} migrations in {", ".join(apps)}...{COL_END}')
+        for app, names in apps.items():
+            print(f'  {app}: {", ".join(names)}')
+    else:
+        print(f'{CYAN}Migrating database...{COL_END}')
+
+    # verbosity 2 reports the duration of each migration
+    start = time.perf_counter()
+    result = virtual_env.manage(c, 'migrate --noinput --verbosity 2')
+    applied = re.findall(r'Applying (\S+)\.\.\. OK \(([\d.]+)s\)', result.stdout)
+    if applied:
+        print(f'{CYAN}Migration timings:{COL_END}')
+        for migration, seconds in applied:
+            print(f'  {migration:<60} {float(seconds):8.2f}s')
+    print(f'{GREEN}Applied {len(applied)} migrations in {time.perf_counter() - start:.1f}s{COL_END}')
+
+    # recorded after a successful migrate
+    _record_migrations(c)
     return True
 
 
+@declare(needs=['connection', 'src_path', 'backup_path'], provides=['project_backup'])
 def backup_project(c):
     """
-    Backup remote project files.
+    Backup remote project files, as configured in project.backup:
+        archive: full archive of the last version (default)
+        snapshot: incremental snapshot, only changed files are stored
+    Not needed for releases: the previous release is kept.
     """
+    if c.config.project.get('upload') == 'release':
+        return True
+
+    if c.config.project.get('backup') == 'snapshot':
+        return _snapshots.backup(c)
+
     print(f'{CYAN}Creating backup of remote project...{COL_END}')
 
     # create backup dir
     c.run(f'mkdir -p {c.config.data.backup_path}')
 
-    file_name = f'{c.config.data.backup_path}/{c.config.project.name}.last.tar.gz'
+    codec = _archive.pick_codec(c, _archive.available_codecs(c))
+    base_name = f'{c.config.data.backup_path}/{c.config.project.name}.last.tar'
+    file_name = f'{base_name}.{_archive.CODECS[codec]["ext"]}'
     exclude_args = ' '.join(f"--exclude='{e}'" for e in c.config.archive_excludes)
     src_sub = c.config.data.src_path.split('/')[-1]
-    c.run(f'cd {c.config.data.app_path} && tar -czf {file_name} {exclude_args} {src_sub}', echo=True)
+    # replace backup of other codecs, only after the new backup is complete
+    exts = {x['ext'] for x in _archive.CODECS.values()} - {_archive.CODECS[codec]['ext']}
+    others = ' '.join(f'{base_name}.{ext}' for ext in exts)
+    c.run(f'set -o pipefail && cd {c.config.data.app_path} '
+          f'&& (tar -cf - {exclude_args} {src_sub} | {_archive.compress_command(c, codec)} > {file_name}.tmp '
+          f'|| {{ rm -f {file_name}.tmp; exit 1; }}) '
+          f'&& mv {file_name}.tmp {file_name} && rm -f {others}', echo=True)
     return True
 
 
+@declare(needs=['connection', 'src_path', 'backup_path', 'project_backup'], provides=['src'])
 def restore_project(c):
     """
-    Restore latest version of project files.
+    Restore latest version of project files, or the snapshot in config.data.restore_snapshot.
     """
-    file_name = f'{c.config.data.backup_path}/{c.config.project.name}.last.tar.gz'
-    result = c.run(f'stat {file_name}', hide=True)
-    if not result.ok:
-        print(f'{RED}Could not find project backup: {file_name}{COL_END}')
+    if not _forget_src_manifest(c):
+        return False
+
+    if c.config.project.get('upload') == 'release':
+        return _releases.restore(c)
+
+    if c.config.project.get('backup') == 'snapshot':
+        return _snapshots.restore(c)
+
+    base_name = f'{c.config.data.backup_path}/{c.config.project.name}.last.tar'
+    # only complete backups, not the .tmp of a failed backup
+    files = ' '.join(f'{base_name}.{ext}' for ext in sorted({x['ext'] for x in _archive.CODECS.values()}))
+    result = c.run(f'ls -t {files}', hide=True, warn=True)
+    if not result.stdout.strip():
+        print(f'{RED}Could not find project backup: {base_name}.*{COL_END}')
+        return False
+
+    file_name = result.stdout.split()[0]
+    decompress = _archive.decompress_command(file_name.rsplit('.', 1)[-1], _archive.available_codecs(c))
+    if not decompress:
+        print(f'{RED}No decompressor available for project backup: {file_name}{COL_END}')
         return False
 
     src_sub = c.config.data.src_path.split('/')[-1]
-    c.run(f'cd {c.config.data.app_path} && tar -zxf {file_name} {src_sub}', echo=True)
+    c.run(f'set -o pipefail && cd {c.config.data.app_path} && {decompress} < {file_name} | tar -xf - {src_sub}',
+          echo=True)
     return True
 
 
+def list_snapshots(c):
+    """
+    Print available snapshots of project files.
+    """
+    print(f'{CYAN}Snapshots (id, files, bytes):{COL_END}')
+    print(_snapshots.listing(c), end='')
+    return True
+
+
+@declare(needs=['connection', 'app_path', 'src_path', 'project_backup'], provides=['src'])
 def upload(c):
     """
-    Upload project source files.
-    Creates local tar, scp to remote, unzip on remote, cleanup.
+    Upload project source files, as configured in project.upload:
+        archive: full archive of the source (default)
+        delta: only files changed since the last upload
+        release: new release dir, built from a content store, src is a symlink to it
+        stream: archive streamed over the ssh connection, without temporary archive files
+    With project.static: local, static files are collected and compressed locally and uploaded too.
+    """
+    mode = c.config.project.get('upload') or 'archive'
+    if mode != 'delta' and not _forget_src_manifest(c):
+        return False
+
+    if mode == 'delta':
+        ok = _upload_delta(c)
+    elif mode == 'stream':
+        ok = _upload_stream(c)
+    elif mode == 'release':
+        ok = _releases.upload(c)
+    elif mode == 'archive':
+        ok = _upload_archive(c)
+    else:
+        print(f'{RED}Unknown upload mode: {mode}.{COL_END}')
+        return False
+
+    if ok and c.config.project.get('static') == 'local':
+        return _static.upload(c)
+    return ok
+
+
+def _upload_archive(c):
+    """
+    Creates local tar, upload to remote, unzip on remote, cleanup.
     """
     env = {'PATH': '/usr/bin:/bin'}
     print(f'{CYAN}Uploading project {c.config.project.name}...{COL_END}')
@@ -101,38 +436,419 @@ def upload(c):
     fab_path = dirname(c.config._runtime_path)
 
     # create archive of source code
-    file_name = f'{c.config.project.name}.tar.gz'
+    codec, decompress = _archive.transfer_codec(c)
+    file_name = f'{c.config.project.name}.tar.{_archive.CODECS[codec]["ext"]}'
     exclude_args = ' '.join(f"--exclude='{e}'" for e in c.config.archive_excludes)
-    c.local(f'cd {fab_path} && tar -czf /tmp/{file_name} {exclude_args} {c.config.project.source}', env=env)
+    c.local(f'set -o pipefail && cd {fab_path} && tar -cf - {exclude_args} {c.config.project.source} '
+            f'| {_archive.compress_command(c, codec)} > /tmp/{file_name}', env=env)
 
     # upload archive to remote server
-    c.local(f'scp /tmp/{file_name} {c.config.project.user}:{c.config.data.app_path}', pty=True, echo=True, env=env)
+    size = os.path.getsize(f'/tmp/{file_name}')
+    start = time.perf_counter()
+    c.put(f'/tmp/{file_name}', f'{c.config.data.app_path}/{file_name}')
+    seconds = time.perf_counter() - start
     c.local(f'rm /tmp/{file_name}', env=env)
+    print(f'{GREEN}Sent {size / 1e6:.1f} MB in {seconds:.1f}s: {size / 1e6 / max(seconds, 1e-6):.1f} MB/s{COL_END}')
 
     # extract archive to fresh source path
     src_dir = c.config.data.src_path.split('/')[-1]
-    c.run(f'cd {c.config.data.app_path} && rm -rf {src_dir} && tar -zxf {file_name} && rm {file_name}')
+    c.run(f'set -o pipefail && cd {c.config.data.app_path} && rm -rf {src_dir} '
+          f'&& {decompress} < {file_name} | tar -xf - && rm {file_name}')
+    return True
+
+
+def _upload_delta(c):
+    """
+    Compares hashes of local source files with the manifest of the last upload and
+    uploads changed files only. Files on remote that are not in the local source are
+    removed, resulting in the same fresh source tree as an archive upload.
+    Falls back to an archive upload when there is no remote manifest.
+    """
+    env = {'PATH': '/usr/bin:/bin'}
+    app_path = c.config.data.app_path
+    src_dir = c.config.data.src_path.split('/')[-1]
+    manifest_path = _src_manifest_path(c)
+
+    print(f'{CYAN}Uploading changes of project {c.config.project.name}...{COL_END}')
+    fab_path = dirname(c.config._runtime_path)
+    local = _archive.local_manifest(fab_path, c.config.project.source, c.config.archive_excludes)
+
+    result = c.run(f'cat {manifest_path}', warn=True, hide=True)
+    if not result.ok:
+        print(f'{YELLOW}No remote manifest found, uploading full archive.{COL_END}')
+        if not _upload_archive(c):
+            return False
+        c.put(io.StringIO(json.dumps(local)), manifest_path)
+        return True
+    uploaded = json.loads(result.stdout)
+
+    # current remote files and sizes, to detect changes made on remote since the last upload
+    result = c.run(f"cd {app_path} && find {src_dir} \\( -type f -o -type l \\) -printf '%s\\t%p\\n'", hide=True)
+    remote = {}
+    for line in result.stdout.splitlines():
+        size, path = line.split('\t', 1)
+        remote[path] = int(size)
+
+    changed = [path for path, (digest, size) in local.items()
+               if uploaded.get(path, [None])[0] != digest or remote.get(path) != size]
+    deleted = [path for path in remote if path not in local]
+    print(f'{len(changed)} changed, {len(deleted)} deleted, {len(local) - len(changed)} unchanged files.')
+
+    if changed:
+        codec, decompress = _archive.transfer_codec(c)
+        file_name = f'{c.config.project.name}.delta.tar.{_archive.CODECS[codec]["ext"]}'
+        list_name = f'/tmp/{c.config.project.name}.delta.list'
+        with open(list_name, 'w') as f:
+            f.write('\n'.join(changed) + '\n')
+        c.local(f'set -o pipefail && cd {fab_path} && tar -cf - -T {list_name} '
+                f'| {_archive.compress_command(c, codec)} > /tmp/{file_name}', env=env)
+        c.put(f'/tmp/{file_name}', f'{app_path}/{file_name}')
+        c.local(f'rm /tmp/{file_name} {list_name}', env=env)
+        c.run(f'set -o pipefail && cd {app_path} && {decompress} < {file_name} | tar -xf - && rm {file_name}')
+
+    if deleted:
+        list_path = f'{app_path}/.{src_dir}.deleted'
+        c.put(io.StringIO('\n'.join(deleted) + '\n'), list_path)
+        c.run(f'cd {app_path} && xargs -d "\\n" rm -f < {list_path} && rm {list_path} '
+              f'&& find {src_dir} -mindepth 1 -type d -empty -delete')
+
+    c.put(io.StringIO(json.dumps(local)), manifest_path)
     return True
 
 
+def _src_manifest_path(c):
+    """
+    Manifest of the last delta upload, see _upload_delta.
+    """
+    return f'{c.config.data.app_path}/.{c.config.data.src_path.split("/")[-1]}.manifest.json'
+
+
+def _forget_src_manifest(c):
+    """
+    Remove the manifest of the last delta upload, when src is written otherwise (other upload
+    modes, restore): the next delta upload is a full upload, instead of comparing to stale hashes.
+    """
+    return c.run(f'rm -f {_src_manifest_path(c)}', hide=True, warn=True).ok
+
+
+class _ChannelWriter:
+    """
+    File-like object writing to a paramiko channel, counting bytes sent.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.bytes_sent = 0
+
+    def write(self, data):
+        self.channel.sendall(data)
+        self.bytes_sent += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _upload_stream(c):
+    """
+    Streams a compressed tar of the source, generated in-process, over the ssh connection
+    into tar on remote. The tree is extracted next to src and swapped in when complete.
+    """
+    app_path = c.config.data.app_path
+    src_dir = c.config.data.src_path.split('/')[-1]
+    excludes = c.config.archive_excludes
+    fab_path = dirname(c.config._runtime_path)
+
+    print(f'{CYAN}Streaming project {c.config.project.name}...{COL_END}')
+    c.open()
+    codec, decompress = _archive.transfer_codec(c)
+    # a plain channel doesn't get run.env (eg. PATH with ~/bin, where the decompressor may be)
+    env = ''.join(f'export {key}="{value}" && ' for key, value in (c.config.run.get('env') or {}).items())
+    channel = c.client.get_transport().open_session()
+    channel.exec_command(f'{env}set -o pipefail && cd {app_path} && rm -rf {src_dir}.new && mkdir {src_dir}.new '
+                         f'&& {decompress} | tar -xf - -C {src_dir}.new '
+                         f'&& rm -rf {src_dir} && mv {src_dir}.new/{src_dir} {src_dir} && rmdir {src_dir}.new')
+
+    start = time.perf_counter()
+    raw_bytes = 0
+
+    def exclude(tarinfo):
+        nonlocal raw_bytes
+        if _archive.excluded(tarinfo.name, excludes):
+            return None
+        raw_bytes += tarinfo.size
+        return tarinfo
+
+    writer = _ChannelWriter(channel)
+    try:
+        _archive.compressed_tar(c, codec, writer, lambda tar: tar.add(os.path.join(fab_path, c.config.project.source),
+                                                              arcname=src_dir, filter=exclude))
+    except OSError as e:
+        # remote exited early, its status and error tell why
+        print(f'{YELLOW}Streaming stopped: {e}{COL_END}')
+    channel.shutdown_write()
+
+    status = channel.recv_exit_status()
+    seconds = time.perf_counter() - start
+    if status != 0:
+        print(f'{RED}Extracting on remote failed: {channel.makefile_stderr("rb").read().decode()}{COL_END}')
+        return False
+
+    print(f'{GREEN}Sent {writer.bytes_sent / 1e6:.1f} MB ({raw_bytes / 1e6:.1f} MB uncompressed) '
+          f'in {seconds:.1f}s: {writer.bytes_sent / 1e6 / max(seconds, 1e-6):.1f} MB/s{COL_END}')
+    return True
+
+
+@declare(needs=['connection', 'env', 'env_path', 'src'], provides=['requirements'])
 def install_requirements(c):
     """
-    Install project requirements.
+    Install project requirements. Skipped when requirements and python version are unchanged
+    since the last install, see REQUIREMENTS_STATE; only changed requirements are installed
+    when the install options are unchanged.
+    With project.envs, changed requirements are installed in a new env, see _install_env.
     """
-    print(f'{CYAN}Installing project requirements...{COL_END}')
-    virtual_env.pip(c, f'--upgrade pip')
-    # virtual_env.pip(c, f'--upgrade python-dotenv[cli]')
-    virtual_env.pip(c, f'-r {c.config.data.src_path}/requirements.txt')
+    files = _read_requirements(c, f'{c.config.data.src_path}/requirements.txt')
+    python_version = c.run(f'{c.config.data.env_path}/bin/python -V', hide=True).stdout.strip()
+    options, lines = _parse_requirements(files)
+    requirements = {
+        'hash': hashlib.sha256(json.dumps([python_version, files], sort_keys=True).encode()).hexdigest(),
+        'python': python_version,
+        'files': files,
+        'options': options,
+        'lines': lines,
+    }
+
+    if c.config.project.get('envs'):
+        return _install_env(c, requirements)
+
+    state = _requirements_state(c, c.config.data.env_path)
+    if state.get('hash') == requirements['hash']:
+        print(f'{BLUE}Requirements unchanged ({python_version}), skipping install.{COL_END}')
+        return True
+
+    return _install(c, c.config.data.env_path, state, requirements)
+
+
+@declare(needs=['connection', 'env_path', 'src'], provides=['requirements'])
+def restore_requirements(c):
+    """
+    Switch back to the env of the restored requirements, with project.envs only (instant when that
+    env is still kept, see _install_env). Without it the env is left as is.
+    """
+    if not c.config.project.get('envs'):
+        print(f'{BLUE}Not using envs (project.envs), skipping requirements.{COL_END}')
+        return True
+
+    return install_requirements(c)
+
+
+def _requirements_state(c, env_path):
+    result = c.run(f'cat {env_path}/{REQUIREMENTS_STATE}', hide=True, warn=True)
+    return json.loads(result.stdout) if result.ok and result.stdout.strip() else {}
+
+
+def _install(c, env_path, state, requirements):
+    """
+    Install requirements in an env, only the changed ones compared to the state of the env.
+    """
+    pip_options = ''
+    if c.config.project.get('wheelhouse'):
+        pip_options = _wheelhouse.ship(c)
+        if pip_options is None:
+            return False
+
+    options, lines = requirements['options'], requirements['lines']
+    changed = [x for x in lines if x not in state.get('lines', [])]
+    if state.get('python') == requirements['python'] and state.get('options') == options:
+        print(f'{CYAN}Installing {len(changed)} changed project requirements...{COL_END}')
+        if changed:
+            diff_file = f'{env_path}/.requirements.diff.txt'
+            # global options and constraints of the full requirements apply to the diff too
+            constraints = [f'-c {path}' for path, (_, constraint) in requirements['files'].items() if constraint]
+            header = [x for x in options if x.startswith('-')] + constraints
+            c.put(io.StringIO('\n'.join(header + changed) + '\n'), diff_file)
+            virtual_env.pip(c, f'{pip_options}-r {diff_file}', env_path=env_path)
+    else:
+        print(f'{CYAN}Installing project requirements...{COL_END}')
+        if not pip_options:
+            # needs the package index
+            virtual_env.pip(c, f'--upgrade pip', env_path=env_path)
+        # virtual_env.pip(c, f'--upgrade python-dotenv[cli]')
+        virtual_env.pip(c, f'{pip_options}-r {c.config.data.src_path}/requirements.txt', env_path=env_path)
+
+    # only recorded after a successful install
+    state = {x: requirements[x] for x in ('hash', 'python', 'options', 'lines')}
+    c.put(io.StringIO(json.dumps(state, indent=4)), f'{env_path}/{REQUIREMENTS_STATE}')
+    return True
+
+
+def _install_env(c, requirements):
+    """
+    Switch the env (a symlink) to the env in app_path/envs for the hash of the requirements.
+    A missing env is built by cloning the current env (hardlinking its files) and installing
+    the changed requirements in the clone, the current env is not touched.
+    Envs beyond project.keep_envs are removed.
+    """
+    env_path = c.config.data.env_path
+    envs_path = f'{c.config.data.app_path}/envs'
+    target = f'{envs_path}/{requirements["hash"][:12]}'
+
+    c.run(f'mkdir -p {envs_path}')
+    if not c.run(f'test -L {env_path}', warn=True, hide=True).ok:
+        # first run: move the existing env into envs
+        state = _requirements_state(c, env_path)
+        legacy = f'{envs_path}/{state["hash"][:12] if state.get("hash") else "initial"}'
+        print(f'Moving virtualenv to {legacy}')
+        c.run(f'mv {env_path} {legacy}')
+        _rewrite_env_paths(c, legacy, env_path)
+        c.run(f'ln -sfn {legacy} {env_path}')
+
+    current = c.run(f'readlink -f {env_path}', hide=True).stdout.strip()
+    if current == target:
+        print(f'{BLUE}Requirements unchanged ({requirements["python"]}), skipping install.{COL_END}')
+        return True
+
+    if _requirements_state(c, target).get('hash') == requirements['hash']:
+        print(f'{CYAN}Switching to existing virtualenv {target}{COL_END}')
+    else:
+        start = time.perf_counter()
+        state = _requirements_state(c, current)
+        # leftovers of an incomplete build
+        c.run(f'rm -rf {target}')
+        if state.get('python') == requirements['python']:
+            print(f'{CYAN}Cloning virtualenv {current} to {target}...{COL_END}')
+            c.run(f'cp -al {current} {target} && rm -f {target}/{REQUIREMENTS_STATE}')
+            _rewrite_env_paths(c, target, current)
+        else:
+            print(f'{CYAN}Creating virtualenv {target}...{COL_END}')
+            c.run(f'$(readlink -f {current}/bin/python) -m venv {target}')
+            state = {}
+        try:
+            ok = _install(c, target, state, requirements)
+        except Exception as e:
+            print(f'{RED}{e}{COL_END}')
+            ok = False
+        if not ok:
+            print(f'{RED}Installing requirements failed, keeping virtualenv {current}{COL_END}')
+            c.run(f'rm -rf {target}')
+            return False
+        print(f'{GREEN}Built virtualenv {target} in {time.perf_counter() - start:.1f}s{COL_END}')
+
+    # atomic switch, the touch orders envs by last use
+    c.run(f'touch {target} && ln -sfn {target} {env_path}.tmp && mv -T {env_path}.tmp {env_path}')
+    _prune_envs(c, envs_path, target)
     return True
 
 
+def _rewrite_env_paths(c, env_path, old_path):
+    """
+    Point scripts in bin (activate, console scripts) of a moved or copied env to its new path.
+    sed replaces files, so hardlinked scripts of a cloned env are not changed.
+    """
+    c.run(f"grep -lI '{old_path}' {env_path}/bin/* | xargs -r sed -i 's|{old_path}|{env_path}|g'",
+          hide=True, warn=True)
+
+
+def _prune_envs(c, envs_path, current):
+    keep = int(c.config.project.get('keep_envs') or DEFAULT_KEEP_ENVS)
+    result = c.run(f'ls -td {envs_path}/*/', hide=True)
+    envs = [x.rstrip('/') for x in result.stdout.split()]
+    old = [x for x in envs if x != current][max(keep - 1, 0):]
+    if old:
+        print(f'Removing {len(old)} old virtualenvs.')
+        c.run(f'rm -rf {" ".join(old)}')
+
+
+def _read_requirements(c, path, files=None, constraint=False, local=False):
+    """
+    Read a remote (or local) requirements file and the files it includes with -r or -c.
+    :return: Dict of path and tuple of contents and whether it is a constraints file
+    """
+    files = {} if files is None else files
+    if local:
+        with open(path) as f:
+            contents = f.read()
+    else:
+        contents = c.run(f'cat {path}', hide=True).stdout
+    files[path] = (contents, constraint)
+    for line in contents.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] in ('-r', '--requirement', '-c', '--constraint'):
+            include = os.path.join(dirname(path), parts[1])
+            if include not in files:
+                _read_requirements(c, include, files, constraint or parts[0] in ('-c', '--constraint'), local)
+    return files
+
+
+def _parse_requirements(files):
+    """
+    Split requirement files in options (eg. --index-url, constraints) and requirement lines.
+    :return: Tuple of sorted lists of options and requirements
+    """
+    options, lines = set(), set()
+    for contents, constraint in files.values():
+        for line in contents.replace('\\\n', ' ').splitlines():
+            # comments start at a # at the start of a line or after whitespace
+            line = ' '.join(re.split(r'(?:^|\s)#', line)[0].split())
+            if not line or line.split()[0] in ('-r', '--requirement', '-c', '--constraint'):
+                continue
+            if constraint or (line.startswith('-') and not line.startswith(('-e', '--editable'))):
+                options.add(line)
+            else:
+                lines.add(line)
+    return sorted(options), sorted(lines)
+
+
+@declare(needs=['connection', 'requirements', 'src'], provides=['static'])
 def update_static_files(c):
     """
-    Collects and compresses static files.
+    Collects and compresses static files. Skipped when no static files, templates (used by
+    compress) or requirements (apps with static files) changed since the last run, see _static.STATIC_MANIFEST.
     """
-    print(f'{CYAN}Processing static files...{COL_END}')
-    virtual_env.manage(c, 'collectstatic --noinput --verbosity 0', warn=True)
+    if c.config.project.get('static') == 'local':
+        print(f'{BLUE}Static files are built locally and uploaded, skipping.{COL_END}')
+        return True
+
+    manifest_path = f'{c.config.data.app_path}/{_static.STATIC_MANIFEST}'
+    result = c.run(f'cat {manifest_path}', hide=True, warn=True)
+    previous = json.loads(result.stdout) if result.ok and result.stdout.strip() else {}
+    manifest = {
+        'requirements': _requirements_state(c, c.config.data.env_path).get('hash'),
+        'files': _static.files(c),
+    }
+    if manifest['files'] is None:
+        print(f'{YELLOW}Could not find static files and templates, processing all.{COL_END}')
+        virtual_env.manage(c, 'collectstatic --noinput --verbosity 0', warn=True)
+        virtual_env.manage(c, 'compress --force', warn=True)
+        # without a manifest, the next run processes all again
+        c.run(f'rm -f {manifest_path}')
+        return True
+
+    changed = {}
+    for kind, files in manifest['files'].items():
+        before = previous.get('files', {}).get(kind, {})
+        changed[kind] = [path for path in set(files) | set(before) if files.get(path) != before.get(path)]
+    requirements_changed = previous.get('requirements') != manifest['requirements']
+    if not any(changed.values()) and not requirements_changed:
+        print(f'{BLUE}Static files and templates unchanged, skipping collectstatic and compress.{COL_END}')
+        return True
+
+    print(f'{CYAN}Processing static files: {len(changed["static"])} static files and '
+          f'{len(changed["templates"])} templates changed'
+          f'{", requirements changed" if requirements_changed else ""}...{COL_END}')
+    start = time.perf_counter()
+    collected = True
+    if requirements_changed or changed['static']:
+        # without --clear, only modified files are copied
+        collected = virtual_env.manage(c, 'collectstatic --noinput --verbosity 0', warn=True).ok
 
     # compress is a command from whitenoise, will be ignored if not used
     virtual_env.manage(c, 'compress --force', warn=True)
+    if not collected:
+        # not recorded: the next run collects again
+        print(f'{YELLOW}collectstatic failed, static files will be processed again next time.{COL_END}')
+        c.run(f'rm -f {manifest_path}')
+        return True
+
+    c.put(io.StringIO(json.dumps(manifest)), manifest_path)
+    print(f'{GREEN}Processed static files in {time.perf_counter() - start:.1f}s{COL_END}')
     return True
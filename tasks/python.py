@@ -1,11 +1,16 @@
+import time
 from distutils.version import StrictVersion
 
+from ._scheduler import declare
 from ._constants import *
-from ._util import find_executable, pre_install_executable, download_executable
+from ._batch import Batch
+from ._util import (find_executables, pre_install_executable, download_executable,
+                    build_jobs, build_key, fetch_build, store_build)
 
 DEFAULT_PYTHON = '3.6'
 
 
+@declare(needs=['connection'], provides=['python_bin'], interactive=True)
 def install_bin(c):
     """
     Verify if requested python is installed on server, either in system or custom.
@@ -24,43 +29,48 @@ def install_bin(c):
         # stop install, continue on to next task
         return True
 
-    # download python
-    base_name = f'Python-{raw_version}'
-    file_name = f'{base_name}.tgz'
-    file_url = f'https://www.python.org/ftp/python/{raw_version}/{file_name}'
-    cont = download_executable(c, file_name, file_url)
-    if not cont:
-        # bad download, quit
-        return False
-
-    # install python
+    # install python, from the build cache or build it
     install_path = f'$HOME/opt/python-{raw_version}'
-    print(f'{CYAN}Installing: {file_name} to {install_path}...{COL_END}')
-    c.run('&&'.join([
-        f'cd $HOME/src',
-        f'tar zxf {file_name}']))
-    c.run('&&'.join([
-        f'export TMPDIR=$HOME/tmp',
-        f'cd $HOME/src/{base_name}',
-        f'./configure --prefix={install_path}',
-        f'make && make install']))
-    c.run(f'rm $HOME/src/{file_name}')
+    optimize = (c.config.get('build') or {}).get('optimizations')
+    key = build_key(c, f'python-{raw_version}{"-opt" if optimize else ""}')
+    if not fetch_build(c, key, f'python-{raw_version}'):
+        # download python
+        base_name = f'Python-{raw_version}'
+        file_name = f'{base_name}.tgz'
+        file_url = f'https://www.python.org/ftp/python/{raw_version}/{file_name}'
+        cont = download_executable(c, file_name, file_url)
+        if not cont:
+            # bad download, quit
+            return False
+
+        jobs = build_jobs(c)
+        # profile guided optimizations and link time optimization: faster python, much slower build
+        options = ' --enable-optimizations --with-lto' if optimize else ''
+        print(f'{CYAN}Installing: {file_name} to {install_path} ({jobs} jobs)...{COL_END}')
+        start = time.perf_counter()
+        c.run('&&'.join([
+            f'cd $HOME/src',
+            f'tar zxf {file_name}']))
+        c.run('&&'.join([
+            f'export TMPDIR=$HOME/tmp',
+            f'cd $HOME/src/{base_name}',
+            f'./configure --prefix={install_path}{options}',
+            f'make -j{jobs} && make install']))
+        c.run(f'rm $HOME/src/{file_name}')
+        print(f'{GREEN}Built Python {raw_version} in {time.perf_counter() - start:.0f}s{COL_END}')
+        store_build(c, key, f'python-{raw_version}')
 
     # create symlinks
-    name = f'python{maj_version}.{min_version}'
-    c.run(f'ln -sf {install_path}/bin/{name} ~/bin/{name}')
-    name = f'python{maj_version}'
-    c.run(f'ln -sf {install_path}/bin/{name} ~/bin/{name}')
-
-    name = f'pip{maj_version}.{min_version}'
-    c.run(f'ln -sf {install_path}/bin/{name} ~/bin/{name}')
-    name = f'pip{maj_version}'
-    c.run(f'ln -sf {install_path}/bin/{name} ~/bin/{name}')
+    with Batch(c) as batch:
+        for name in [f'python{maj_version}.{min_version}', f'python{maj_version}',
+                     f'pip{maj_version}.{min_version}', f'pip{maj_version}']:
+            batch.run(f'ln -sf {install_path}/bin/{name} ~/bin/{name}')
 
     print(f'{GREEN}Successfully installed Python {requested_version}!')
     return True
 
 
+@declare(needs=['connection', 'python_bin'], provides=['python_app', 'pip_app'])
 def find_bin(c):
     """
     Find requested python & pip executables and save in config.
@@ -72,13 +82,10 @@ def find_bin(c):
 
     print(f'{CYAN}Retrieving paths of python and pip...{COL_END}')
 
-    python_app = find_executable(c, f'python{maj_version}.{min_version}')
-    if not python_app:
-        return False
-
-    pip_app = find_executable(c, f'pip{maj_version}.{min_version}')
-    if not pip_app:
+    paths = find_executables(c, f'python{maj_version}.{min_version}', f'pip{maj_version}.{min_version}')
+    if not paths:
         return False
+    python_app, pip_app = paths
 
     # save in config
     c.config.python_app = python_app
@@ -1,42 +1,14 @@
+import time
 from distutils.version import StrictVersion
 
-from ._util import (get_app_id, create_app, get_app_info,
-                    pre_install_executable, download_executable, find_executable)
+from ._batch import Batch
+from ._util import (get_app_info, pre_install_executable, download_executable, find_executables,
+                    build_jobs, build_key, fetch_build, store_build)
+from ._scheduler import declare
 from ._constants import *
 
 
-def get_id(c):
-    """
-    Find redis-app-id by project name. Add id to config.
-    """
-    if not c.config.project.dependencies.get('redis'):
-        # nothing to do
-        return True
-
-    app_name = f'{c.config.project.name}_redis'
-    app_id = get_app_id(c, app_name)
-    if not isinstance(app_id, str):
-        return app_id
-
-    c.config.data.redis_app_id = app_id
-    print(f'{GREEN}Found redis-app-id: {c.config.data.redis_app_id} for {app_name}{COL_END}')
-    return True
-
-
-def create(c):
-    """
-    Create redis app. Add id to config.
-    """
-    if not c.config.project.dependencies.get('redis'):
-        # nothing to do
-        return True
-
-    app_name = f'{c.config.project.name}_redis'
-    app_id = c.config.data.get('redis_app_id')
-    c.config.data.redis_app_id = create_app(c, app_name, app_id)
-    return True
-
-
+@declare(needs=['api', 'redis_app_id', 'redis_app_info'], provides=['redis_app_info'])
 def get_info(c):
     """
     Find redis app-info by redis-app-id. Add info to config.
@@ -45,11 +17,16 @@ def get_info(c):
         # nothing to do
         return True
 
+    if c.config.data.get('redis_app_info'):
+        # already discovered
+        return True
+
     app_id = c.config.data.get('redis_app_id')
     c.config.data.redis_app_info = get_app_info(c, app_id)
     return True
 
 
+@declare(needs=['connection'], provides=['redis_bin'], interactive=True)
 def install_bin(c):
     raw_version = c.config.project.dependencies.get('redis')
     if not raw_version:
@@ -65,39 +42,48 @@ def install_bin(c):
         # stop install, continue on to next task
         return True
 
-    base_name = f'redis-{raw_version}'
-    file_name = f'{base_name}.tar.gz'
-    file_url = f'http://download.redis.io/releases/{file_name}'
-    cont = download_executable(c, file_name, file_url)
-    if not cont:
-        # bad install, quit
-        return False
-
-    # install redis
+    # install redis, from the build cache or build it
     install_path = f'$HOME/opt/redis-{raw_version}'
-    print(f'{CYAN}Installing: {file_name} to {install_path}...{COL_END}')
-    c.run('&&'.join([
-        f'cd $HOME/src',
-        f'tar zxf {file_name}']))
-    c.run('&&'.join([
-        f'export TMPDIR=$HOME/tmp',
-        f'cd $HOME/src/{base_name}',
-        f'make']))
-    c.run(f'rm $HOME/src/{file_name}')
-
-    # copy config (defaults are overridden on commandline)
-    c.run(f'cp $HOME/src/{base_name}/redis.conf $HOME/etc/redis.conf')
-
-    # create symlinks
-    name = f'redis-cli'
-    c.run(f'ln -sf $HOME/src/{base_name}/src/{name} ~/bin/{name}')
-    name = f'redis-server'
-    c.run(f'ln -sf $HOME/src/{base_name}/src/{name} ~/bin/{name}')
+    # redis binaries don't refer to their prefix: a build is reused as is, for any user
+    key = build_key(c, f'redis-{raw_version}')
+    if not fetch_build(c, key, f'redis-{raw_version}', relocate=False):
+        base_name = f'redis-{raw_version}'
+        file_name = f'{base_name}.tar.gz'
+        file_url = f'http://download.redis.io/releases/{file_name}'
+        cont = download_executable(c, file_name, file_url)
+        if not cont:
+            # bad install, quit
+            return False
+
+        jobs = build_jobs(c)
+        print(f'{CYAN}Installing: {file_name} to {install_path} ({jobs} jobs)...{COL_END}')
+        start = time.perf_counter()
+        c.run('&&'.join([
+            f'cd $HOME/src',
+            f'tar zxf {file_name}']))
+        c.run('&&'.join([
+            f'export TMPDIR=$HOME/tmp',
+            f'cd $HOME/src/{base_name}',
+            f'make -j{jobs}',
+            f'make install PREFIX={install_path}',
+            f'cp redis.conf {install_path}/redis.conf']))
+        c.run(f'rm -rf $HOME/src/{file_name} $HOME/src/{base_name}')
+        print(f'{GREEN}Built Redis {raw_version} in {time.perf_counter() - start:.0f}s{COL_END}')
+        store_build(c, key, f'redis-{raw_version}')
+
+    with Batch(c) as batch:
+        # copy config (defaults are overridden on commandline)
+        batch.run(f'cp {install_path}/redis.conf $HOME/etc/redis.conf')
+
+        # create symlinks
+        for name in ['redis-cli', 'redis-server']:
+            batch.run(f'ln -sf {install_path}/bin/{name} ~/bin/{name}')
 
     print(f'{GREEN}Successfully installed Redis {requested_version}!')
     return True
 
 
+@declare(needs=['connection', 'redis_bin'], provides=['redis_cli', 'redis_server'])
 def find_bin(c):
     """
     Find redis executables and save in config.
@@ -109,13 +95,10 @@ def find_bin(c):
 
     print(f'{CYAN}Retrieving paths of redis-server and redis-cli...{COL_END}')
 
-    redis_cli = find_executable(c, 'redis-cli')
-    if not redis_cli:
-        return False
-
-    redis_server = find_executable(c, 'redis-server')
-    if not redis_server:
+    paths = find_executables(c, 'redis-cli', 'redis-server')
+    if not paths:
         return False
+    redis_cli, redis_server = paths
 
     # save in config
     c.config.redis_cli = redis_cli
@@ -0,0 +1,12 @@
+"""
+Scripts run on the server (or locally, build_static) as standalone programs: they only use
+the standard library and are uploaded as is, see path.
+"""
+import os
+
+
+def path(name):
+    """
+    Local path of a script, to upload with c.put.
+    """
+    return os.path.join(os.path.dirname(__file__), f'{name}.py')
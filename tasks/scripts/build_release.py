@@ -0,0 +1,40 @@
+"""
+Build a release dir on the server by hardlinking files from the content store, prints its name.
+
+    python3 build_release.py <store> <releases> <listing>
+
+Each line of the listing is tab separated: F, store file and path, or L, link target and path.
+"""
+import os
+import sys
+import time
+
+
+def build(store, releases, listing):
+    """
+    :return: Name of the new release
+    """
+    # releases are named by time, unique: wait for the next second when taken
+    while True:
+        name = time.strftime('%Y%m%d%H%M%S')
+        release = os.path.join(releases, name)
+        try:
+            os.mkdir(release)
+            break
+        except FileExistsError:
+            time.sleep(1)
+
+    with open(listing) as f:
+        for line in f:
+            kind, ref, path = line.rstrip('\n').split('\t', 2)
+            dest = os.path.join(release, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if kind == 'L':
+                os.symlink(ref, dest)
+            else:
+                os.link(os.path.join(store, ref), dest)
+    return name
+
+
+if __name__ == '__main__':
+    print(build(*sys.argv[1:4]))
@@ -0,0 +1,26 @@
+"""
+Collect and compress static files into $STATIC_BUILD_ROOT, run locally in the source dir
+with the project's python and $DJANGO_SETTINGS_MODULE (project.static: local).
+"""
+import os
+import sys
+
+
+def build(build_root):
+    import django
+    from django.conf import settings
+    from django.core.management import call_command, CommandError
+
+    django.setup()
+    settings.STATIC_ROOT = settings.COMPRESS_ROOT = build_root
+    call_command('collectstatic', interactive=False, clear=True, verbosity=0)
+    try:
+        call_command('compress', force=True)
+    except CommandError:
+        # no compress command installed
+        pass
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    build(os.environ['STATIC_BUILD_ROOT'])
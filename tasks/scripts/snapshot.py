@@ -0,0 +1,157 @@
+"""
+Incremental snapshots of the src dir, run on the server: changed files are stored as gzipped,
+content-addressed chunks in backup_path/chunks, a manifest per snapshot in backup_path/snapshots.
+
+    python3 snapshot.py snapshot <backup_path> <src> <excludes as json>
+    python3 snapshot.py restore <backup_path> <src> <snapshot id or latest>
+    python3 snapshot.py prune <backup_path> <keep>
+    python3 snapshot.py list <backup_path>
+"""
+import fnmatch
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import time
+
+
+def manifests(backup_path):
+    path = os.path.join(backup_path, 'snapshots')
+    return sorted(x[:-5] for x in os.listdir(path) if x.endswith('.json')) if os.path.isdir(path) else []
+
+
+def load(backup_path, snapshot_id):
+    with open(os.path.join(backup_path, 'snapshots', f'{snapshot_id}.json')) as f:
+        return json.load(f)
+
+
+def chunk_path(backup_path, digest):
+    return os.path.join(backup_path, 'chunks', digest[:2], digest)
+
+
+def snapshot(backup_path, src, excludes):
+    """
+    Store changed files of src as chunks and write a manifest of all files.
+    :return: Tuple of snapshot id, number of files and number of new chunks
+    """
+    ids = manifests(backup_path)
+    previous = load(backup_path, ids[-1]) if ids else {}
+    files, new = {}, 0
+    for root, dirs, names in os.walk(src):
+        dirs[:] = [d for d in dirs if not any(fnmatch.fnmatch(d, e) for e in excludes)]
+        for name in names:
+            if any(fnmatch.fnmatch(name, e) for e in excludes):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, src)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                files[rel] = {'link': os.readlink(path)}
+                continue
+            prev = previous.get(rel, {})
+            if prev.get('size') == st.st_size and prev.get('mtime') == st.st_mtime:
+                digest = prev['hash']
+            else:
+                h = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        h.update(block)
+                digest = h.hexdigest()
+            chunk = chunk_path(backup_path, digest)
+            if not os.path.exists(chunk):
+                os.makedirs(os.path.dirname(chunk), exist_ok=True)
+                with open(path, 'rb') as f_in, gzip.open(f'{chunk}.tmp', 'wb', 6) as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                os.rename(f'{chunk}.tmp', chunk)
+                new += 1
+            files[rel] = {'hash': digest, 'size': st.st_size, 'mtime': st.st_mtime, 'mode': st.st_mode & 0o7777}
+
+    os.makedirs(os.path.join(backup_path, 'snapshots'), exist_ok=True)
+    # snapshots are named by time, unique: wait for the next second when taken
+    while True:
+        snapshot_id = time.strftime('%Y%m%d%H%M%S')
+        try:
+            f = open(os.path.join(backup_path, 'snapshots', f'{snapshot_id}.json'), 'x')
+            break
+        except FileExistsError:
+            time.sleep(1)
+    with f:
+        json.dump(files, f)
+    return snapshot_id, len(files), new
+
+
+def restore(backup_path, src, snapshot_id):
+    """
+    Replace src by the files of a snapshot, built next to it first.
+    :return: Id of the restored snapshot
+    """
+    ids = manifests(backup_path)
+    if snapshot_id == 'latest' and ids:
+        snapshot_id = ids[-1]
+    if snapshot_id not in ids:
+        sys.exit(f'Snapshot {snapshot_id} not found')
+    target = f'{src}.restore'
+    shutil.rmtree(target, ignore_errors=True)
+    for rel, entry in load(backup_path, snapshot_id).items():
+        dest = os.path.join(target, rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if 'link' in entry:
+            os.symlink(entry['link'], dest)
+            continue
+        with gzip.open(chunk_path(backup_path, entry['hash']), 'rb') as f_in, open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.chmod(dest, entry['mode'])
+        os.utime(dest, (entry['mtime'], entry['mtime']))
+    shutil.rmtree(src, ignore_errors=True)
+    os.rename(target, src)
+    return snapshot_id
+
+
+def prune(backup_path, keep):
+    """
+    Remove snapshots beyond the last keep, and chunks no longer used.
+    :return: Tuple of number of removed snapshots and chunks
+    """
+    ids = manifests(backup_path)
+    for snapshot_id in ids[:-keep]:
+        os.remove(os.path.join(backup_path, 'snapshots', f'{snapshot_id}.json'))
+    used = {x['hash'] for i in ids[-keep:] for x in load(backup_path, i).values() if 'hash' in x}
+    removed = 0
+    for root, dirs, names in os.walk(os.path.join(backup_path, 'chunks')):
+        for name in names:
+            if name not in used:
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return len(ids[:-keep]), removed
+
+
+def listing(backup_path):
+    """
+    :return: List of tuples of snapshot id, number of files and total size
+    """
+    result = []
+    for snapshot_id in manifests(backup_path):
+        files = load(backup_path, snapshot_id)
+        result.append((snapshot_id, len(files), sum(x.get('size', 0) for x in files.values())))
+    return result
+
+
+def main(command, backup_path, *args):
+    if command == 'snapshot':
+        print(*snapshot(backup_path, args[0], json.loads(args[1])))
+    elif command == 'restore':
+        print(restore(backup_path, args[0], args[1]))
+    elif command == 'prune':
+        print(*prune(backup_path, int(args[0])))
+    elif command == 'list':
+        for entry in listing(backup_path):
+            print(*entry)
+    else:
+        sys.exit(f'Unknown command: {command}')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
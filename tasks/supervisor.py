@@ -1,12 +1,14 @@
 import io
 import configparser
 
-from ._util import create_app, get_app_id, find_executable
+from ._util import find_executable
+from ._scheduler import declare
 from ._constants import *
 
 # APP_NAME = 'supervisor'
 
 
+@declare(needs=['connection', 'pip_app'], provides=['supervisor_bin'])
 def install_bin(c):
     """
     Install supervisor in ~/bin through account-wide pip (outside virtual env!)
@@ -45,38 +47,6 @@ def install_bin(c):
     return True
 
 
-def get_id(c):
-    """
-    Find app-id by project name. Add id to config.
-    """
-    if not c.config.project.get('supervisor'):
-        # nothing to do
-        return True
-
-    app_name = f'{c.config.project.user}_supervisor'
-    app_id = get_app_id(c, app_name)
-    if not isinstance(app_id, str):
-        return app_id
-
-    c.config.data.supervisor_app_id = app_id
-    print(f'{GREEN}Found supervisor-app-id: {app_id} for {app_name}{COL_END}')
-    return True
-
-
-def create(c):
-    """
-    Create main project app by name. Add id to config.
-    """
-    if not c.config.project.get('supervisor'):
-        # nothing to do
-        return True
-
-    app_name = f'{c.config.project.user}_supervisor'
-    app_id = c.config.data.get('supervisor_app_id')
-    c.config.data.supervisor_app_id = create_app(c, app_name, app_id)
-    return True
-
-
 def _build_args(args_dict, dl=' '):
     return " ".join([f'--{k}{dl}{v}' for k, v in args_dict.items()])
 
@@ -267,6 +237,8 @@ def _upload_config(c, local_config, remote_path, force_upload=False):
         c.put(io.StringIO(local_config), remote_path)
 
 
+@declare(needs=['connection', 'app_info', 'redis_app_info', 'redis_server', 'env_path', 'log_path'],
+         provides=['supervisor_configs'])
 def create_configs(c):
     if not c.config.project.get('supervisor'):
         # nothing to do
@@ -285,6 +257,8 @@ def create_configs(c):
     return True
 
 
+@declare(needs=['connection', 'app_info', 'redis_app_info', 'redis_server', 'env_path', 'log_path'],
+         provides=['supervisor_configs'])
 def update_configs(c):
     if not c.config.project.get('supervisor'):
         # nothing to do
@@ -300,6 +274,8 @@ def update_configs(c):
     return True
 
 
+@declare(needs=['connection', 'supervisor_bin', 'supervisor_configs', 'src', 'requirements', 'static', 'db'],
+         provides=['started'])
 def start(c):
     # start supervisord
     print(f'{CYAN}Starting supervisord...{COL_END}')
@@ -310,6 +286,8 @@ def start(c):
     return True
 
 
+@declare(needs=['connection', 'supervisor_configs', 'src', 'requirements', 'static', 'migrations', 'db'],
+         provides=['started'])
 def restart(c):
     # restart project
     print(f'{CYAN}Restarting {c.config.project.name}...{COL_END}')
@@ -1,37 +1,15 @@
 import os
-import time
 from textwrap import dedent
 
 from invoke import Context
-from fabric import Connection
 
+from ._connection import connect
+from ._util import wait_ready
+from ._scheduler import declare
 from ._constants import *
 
 
-def get_id(c):
-    """
-    Find user-id by name. Add id to config.
-    """
-    user_name = c.config.project.get('user')
-    if not user_name:
-        # nothing to do
-        return True
-
-    print(f'{CYAN}Retrieving user-id for {user_name}...{COL_END}')
-    response = c.config.control.api.get_users()
-
-    try:
-        rec = next(x for x in response if x['name'] == user_name)
-    except StopIteration:
-        print(f'{YELLOW}No user-id found: user does not exist.{COL_END}')
-        # this is a valid response:
-        return True
-
-    c.config.data.user_id = rec.get('id')
-    print(f'{GREEN}Found user-id: {c.config.data.user_id}{COL_END}')
-    return True
-
-
+@declare(needs=['api', 'server_id', 'user_id'], provides=['user_id', 'user_password'])
 def create(c):
     """
     Create user. Requires server_id. Add id and password to config.
@@ -62,6 +40,7 @@ def create(c):
     return True
 
 
+@declare(needs=['api', 'user_id', 'user_info'], provides=['user_info'])
 def get_info(c):
     """
     Find user-info by user-id. Add info to config.
@@ -71,20 +50,15 @@ def get_info(c):
         # nothing to do
         return True
 
+    if c.config.data.get('user_info'):
+        # already discovered
+        return True
+
     user_id = c.config.data.get('user_id')
 
     # wait for user to be created
-    response = None
-    attempts = 5
-    while attempts > 0:
-        response = c.config.control.api.get_user_info(user_id)
-        if response.get('ready'):
-            break
-
-        print(f'Waiting 5 seconds for user to be created...')
-        time.sleep(5)
-        attempts -= 1
-
+    api = c.config.control.api
+    response = wait_ready(c, {f'User {user_name}': lambda: api.get_user_info(user_id)})[f'User {user_name}']
     if not response.get('ready'):
         print(f'{RED}User {user_name} was not created ok: check control panel!{COL_END}')
         return False
@@ -93,6 +67,7 @@ def get_info(c):
     return True
 
 
+@declare(needs=['user_password', 'user_info'], provides=['connection'], interactive=True)
 def update_ssh(c):
     """
     Update SSH config, if needed, and start using it!
@@ -137,5 +112,6 @@ def update_ssh(c):
 
     # re-create connection with user (after this c.run will be executed on REMOTE!)
     print(f'{GREEN}Updating connection with {user_name}!{COL_END}')
-    c = Connection(user_name, config=c.config)
+    # one connection per host for the whole run, see tasks/_connection.py
+    c = connect(c, user_name)
     return c
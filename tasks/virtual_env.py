@@ -1,6 +1,8 @@
 from tasks._constants import *
+from tasks._scheduler import declare
 
 
+@declare(needs=['connection', 'env_path', 'python_app'], provides=['env'])
 def create(c):
     """
     Create a python virtual env in path of config.
@@ -16,23 +18,24 @@ def create(c):
     return True
 
 
-def run(c, command, **kwargs):
+def run(c, command, env_path=None, **kwargs):
     """
     Run a command in the virtual env.
+    :param env_path: (optional) Path of virtual env, default the one in config
     """
     kwargs.setdefault('echo', True)
-    c.run(f'source {c.config.data.env_path}/bin/activate && {command}', **kwargs)
+    return c.run(f'source {env_path or c.config.data.env_path}/bin/activate && {command}', **kwargs)
 
 
 def pip(c, packages, **kwargs):
     """
     Install packages with pip in virtual env.
     """
-    run(c, f'pip install {packages}', **kwargs)
+    return run(c, f'pip install {packages}', **kwargs)
 
 
 def manage(c, command, **kwargs):
     """
     Run a Django management command in virtual env.
     """
-    run(c, f'cd {c.config.data.src_path} && ./manage.py {command}', **kwargs)
+    return run(c, f'cd {c.config.data.src_path} && ./manage.py {command}', **kwargs)
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from invoke import Config, Context
+
+from tasks._scheduler import declare, execute
+
+
+def context():
+    return Context(config=Config(overrides={'data': {}}))
+
+
+def recording(order, name, result=True, needs=None, provides=(), interactive=False, seconds=0, declared=True):
+    def t(c):
+        order.append(('start', name))
+        time.sleep(seconds)
+        c.config.data[name] = True
+        order.append(('end', name))
+        return result
+    t.__name__ = name
+    if declared:
+        t = declare(needs=needs or (), provides=provides or [name], interactive=interactive)(t)
+    return t
+
+
+def test_runs_in_order_with_one_worker():
+    order = []
+    tasks = [recording(order, x) for x in 'abc']
+    c = execute(context(), tasks, workers=1)
+    assert c is not None
+    assert order == [('start', 'a'), ('end', 'a'), ('start', 'b'), ('end', 'b'), ('start', 'c'), ('end', 'c')]
+
+
+def test_needs_wait_for_provides():
+    order = []
+    seen = {}
+
+    @declare(needs=['a'], provides=['b'])
+    def b(c):
+        seen['a'] = c.config.data.get('a')
+        c.config.data.b = 'done'
+        return True
+
+    tasks = [recording(order, 'a', seconds=0.1), b]
+    c = execute(context(), tasks, workers=4)
+    assert seen['a'] is True
+    # written back to the shared config
+    assert c.config.data.b == 'done'
+
+
+def test_independent_tasks_run_in_parallel():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def waiting(name):
+        @declare(provides=[name])
+        def t(c):
+            barrier.wait()
+            return True
+        t.__name__ = name
+        return t
+
+    assert execute(context(), [waiting('a'), waiting('b')], workers=2) is not None
+
+
+def test_interactive_and_undeclared_tasks_run_alone():
+    order = []
+    tasks = [
+        recording(order, 'a', seconds=0.1),
+        recording(order, 'b', interactive=True),
+        recording(order, 'c', seconds=0.1),
+        recording(order, 'd', declared=False),
+        recording(order, 'e'),
+    ]
+    execute(context(), tasks, workers=4)
+    for name in 'bd':
+        start = order.index(('start', name))
+        assert order[start + 1] == ('end', name)
+        # everything before it has ended, nothing after it has started
+        assert all(('end', x[1]) in order[:start] for x in order[:start] if x[0] == 'start')
+
+
+def test_stops_on_error():
+    for workers in (1, 4):
+        order = []
+        tasks = [recording(order, 'a'), recording(order, 'b', result=False, needs=['a']),
+                 recording(order, 'c', needs=['b'])]
+        assert execute(context(), tasks, workers=workers) is None
+        assert ('start', 'c') not in order
+
+
+def test_stops_on_exception():
+    order = []
+
+    @declare(provides=['b'])
+    def b(c):
+        raise RuntimeError('broken')
+
+    tasks = [b, recording(order, 'c', needs=['b'])]
+    assert execute(context(), tasks, workers=1) is None
+    assert order == []
+
+
+def test_parallel_writers_keep_each_others_changes():
+    order = []
+    tasks = [recording(order, 'a', seconds=0.1), recording(order, 'b', seconds=0.3)]
+    c = context()
+    c.config.data.shared = {'kept': 1}
+    c = execute(c, tasks, workers=2)
+    assert c.config.data.a is True
+    assert c.config.data.b is True
+    assert c.config.data.shared == {'kept': 1}
+
+
+def test_parallel_writers_merge_nested_changes():
+    def writer(name, seconds):
+        @declare(provides=[name])
+        def t(c):
+            time.sleep(seconds)
+            c.config.data.nested[name] = True
+            return True
+        t.__name__ = name
+        return t
+
+    c = context()
+    c.config.data.nested = {'old': True}
+    c = execute(c, [writer('a', 0.1), writer('b', 0.3)], workers=2)
+    assert c.config.data.nested == {'old': True, 'a': True, 'b': True}
@@ -0,0 +1,68 @@
+import os
+
+from tasks import scripts
+from tasks.scripts import build_release, snapshot
+
+
+def write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_paths_are_the_modules():
+    assert scripts.path('snapshot') == snapshot.__file__
+    assert scripts.path('build_release') == build_release.__file__
+
+
+def test_snapshot_restores_files_and_links(tmp_path):
+    src, backup = str(tmp_path / 'src'), str(tmp_path / 'backup')
+    write(f'{src}/app/views.py', 'v1')
+    write(f'{src}/app/cache.pyc', 'excluded')
+    os.symlink('app/views.py', f'{src}/link')
+
+    snapshot_id, files, new = snapshot.snapshot(backup, src, ['*.pyc'])
+    assert (files, new) == (2, 1)
+
+    write(f'{src}/app/views.py', 'v2')
+    write(f'{src}/app/new.py', 'new')
+    assert snapshot.restore(backup, src, snapshot_id) == snapshot_id
+    assert read(f'{src}/app/views.py') == 'v1'
+    assert os.readlink(f'{src}/link') == 'app/views.py'
+    assert sorted(os.listdir(f'{src}/app')) == ['views.py']
+
+
+def test_snapshots_share_chunks_and_prune(tmp_path):
+    src, backup = str(tmp_path / 'src'), str(tmp_path / 'backup')
+    write(f'{src}/a.py', 'a')
+    first, _, _ = snapshot.snapshot(backup, src, [])
+    write(f'{src}/b.py', 'b')
+    second, files, new = snapshot.snapshot(backup, src, [])
+    # taken within a second: ids are still unique
+    assert first < second
+    assert (files, new) == (2, 1)
+    assert [x[0] for x in snapshot.listing(backup)] == [first, second]
+
+    os.remove(f'{src}/a.py')
+    third, _, _ = snapshot.snapshot(backup, src, [])
+    assert snapshot.prune(backup, 1) == (2, 1)
+    assert snapshot.manifests(backup) == [third]
+
+
+def test_build_release_links_store_files(tmp_path):
+    store, releases = tmp_path / 'store', tmp_path / 'releases'
+    releases.mkdir()
+    write(str(store / 'abc-644'), 'contents')
+    listing = tmp_path / 'release.list'
+    listing.write_text('F\tabc-644\tsrc/app/views.py\nL\tapp/views.py\tsrc/link\n')
+
+    name = build_release.build(str(store), str(releases), str(listing))
+    release = releases / name
+    assert (release / 'src/app/views.py').read_text() == 'contents'
+    assert os.stat(release / 'src/app/views.py').st_ino == os.stat(store / 'abc-644').st_ino
+    assert os.readlink(release / 'src/link') == 'app/views.py'